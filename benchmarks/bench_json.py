@@ -0,0 +1,85 @@
+#!/usr/bin/env python3
+
+# Compare output size and serialization rate of the default (indented,
+# sorted) JSON output of extractTIABs.py with compact JSON (-jc) using
+# the json module and, if installed, orjson.
+
+import os
+import sys
+import gzip
+import json
+
+from time import perf_counter
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                os.pardir))
+
+import extractTIABs
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+def argparser():
+    from argparse import ArgumentParser
+    ap = ArgumentParser(description='Benchmark JSON serialization')
+    ap.add_argument('-r', '--repeat', default=3, type=int,
+                    help='number of repetitions, best is reported')
+    ap.add_argument('files', metavar='FILE', nargs='+',
+                    help='PubMed XML file(s)')
+    return ap
+
+
+def load_dicts(files, options):
+    dicts = []
+    for fn in files:
+        stream = gzip.GzipFile(fn) if fn.endswith('.gz') else fn
+        for event, element in extractTIABs.ET.iterparse(stream):
+            if element.tag == 'MedlineCitation':
+                citation = extractTIABs.Citation.from_xml(element)
+                dicts.append(citation.to_dict(options))
+                element.clear()
+    return dicts
+
+
+def serializers():
+    yield 'default', lambda o: json.dumps(o, sort_keys=True, indent=2,
+                                          separators=(',', ': '))
+    yield 'compact json', lambda o: json.dumps(o, ensure_ascii=False,
+                                               separators=(',', ':'))
+    if orjson is not None:
+        yield 'compact orjson', lambda o: orjson.dumps(o).decode('utf-8')
+
+
+def benchmark(dicts, dumps, repeat):
+    best = None
+    for i in range(repeat):
+        start = perf_counter()
+        size = sum(len(dumps(d).encode('utf-8')) for d in dicts)
+        elapsed = perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return size, best
+
+
+def main(argv):
+    args = argparser().parse_args(argv[1:])
+    options = extractTIABs.process_options(
+        ['extractTIABs.py', '-j', '-m', '-mh', '-s'] + args.files)
+    dicts = load_dicts(args.files, options)
+    print('{} citations'.format(len(dicts)))
+    base_size = base_rate = None
+    for name, dumps in serializers():
+        size, elapsed = benchmark(dicts, dumps, args.repeat)
+        rate = len(dicts) / elapsed
+        if base_size is None:
+            base_size, base_rate = size, rate
+        print('{}\t{:.1f} MB\t{:.0f} citations/s\t{:.2f}x size\t'
+              '{:.2f}x rate'.format(name, size/2**20, rate, size/base_size,
+                                     rate/base_rate))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv))
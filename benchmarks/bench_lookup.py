@@ -0,0 +1,119 @@
+#!/usr/bin/env python3
+
+# Load test for scripts/lookupserver.py: send batch lookups from
+# concurrent clients and report request latency percentiles.
+
+import os
+import sys
+import json
+import random
+import socket
+import sqlite3
+import threading
+import http.client
+
+from time import perf_counter
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                os.pardir))
+
+from citationdb import key_to_pmid
+
+
+def argparser():
+    from argparse import ArgumentParser
+    ap = ArgumentParser(description='Load test lookup server')
+    ap.add_argument('-p', '--port', default=8088, type=int,
+                    help='server port on localhost (default 8088)')
+    ap.add_argument('-u', '--unix-socket', metavar='PATH', default=None,
+                    help='connect to Unix socket PATH instead of port')
+    ap.add_argument('-n', '--requests', default=10000, type=int,
+                    help='total number of requests (default 10000)')
+    ap.add_argument('-b', '--batch', default=1, type=int,
+                    help='PMIDs per request (default 1)')
+    ap.add_argument('-c', '--concurrency', default=4, type=int,
+                    help='number of concurrent clients (default 4)')
+    ap.add_argument('-k', '--keys', default=100000, type=int,
+                    help='number of distinct PMIDs to sample (default 100000)')
+    ap.add_argument('db', help='database to sample PMIDs from')
+    return ap
+
+
+class UnixHTTPConnection(http.client.HTTPConnection):
+
+    def __init__(self, path):
+        http.client.HTTPConnection.__init__(self, 'localhost')
+        self.path = path
+
+    def connect(self):
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.sock.connect(self.path)
+
+
+def connect(options):
+    if options.unix_socket is not None:
+        return UnixHTTPConnection(options.unix_socket)
+    else:
+        return http.client.HTTPConnection('127.0.0.1', options.port)
+
+
+def sample_pmids(dbname, count):
+    conn = sqlite3.connect('file:{}?mode=ro'.format(dbname), uri=True)
+    keys = [r[0] for r in conn.execute(
+        'SELECT key FROM unnamed ORDER BY random() LIMIT ?', (count,))]
+    conn.close()
+    return [key_to_pmid(k) for k in keys]
+
+
+def client(options, pmids, requests, latencies, seed):
+    rng = random.Random(seed)
+    conn = connect(options)
+    for i in range(requests):
+        body = json.dumps({'pmids': rng.sample(pmids, options.batch)})
+        start = perf_counter()
+        conn.request('POST', '/get', body,
+                     {'Content-Type': 'application/json'})
+        response = conn.getresponse()
+        response.read()
+        latencies.append(perf_counter() - start)
+        if response.status != 200:
+            raise ValueError('HTTP status {}'.format(response.status))
+    conn.close()
+
+
+def percentile(values, p):
+    return values[min(len(values)-1, int(len(values) * p / 100))]
+
+
+def main(argv):
+    args = argparser().parse_args(argv[1:])
+    pmids = sample_pmids(args.db, args.keys)
+    if len(pmids) < args.batch:
+        print('Too few PMIDs in {}'.format(args.db), file=sys.stderr)
+        return 1
+
+    per_client = args.requests // args.concurrency
+    latencies = [[] for i in range(args.concurrency)]
+    threads = [threading.Thread(target=client,
+                                args=(args, pmids, per_client, l, i))
+               for i, l in enumerate(latencies)]
+    start = perf_counter()
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    elapsed = perf_counter() - start
+
+    latencies = sorted(l for c in latencies for l in c)
+    print('requests\t{}'.format(len(latencies)))
+    print('batch\t{}'.format(args.batch))
+    print('requests/s\t{:.0f}'.format(len(latencies)/elapsed))
+    print('records/s\t{:.0f}'.format(len(latencies)*args.batch/elapsed))
+    for p in (50, 90, 99):
+        print('p{}\t{:.2f} ms'.format(p, 1000*percentile(latencies, p)))
+    print('max\t{:.2f} ms'.format(1000*latencies[-1]))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv))
@@ -0,0 +1,129 @@
+#!/usr/bin/env python3
+
+# Compare makedb.py insert rates for the SqliteDict path, the bulk
+# loader (makedb.py -b) and compressed bulk loading (makedb.py -c),
+# and random read rates and database sizes for the latter two.
+
+import os
+import sys
+import random
+import tarfile
+import tempfile
+
+from time import time
+from logging import warning
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                os.pardir))
+
+from citationdb import BulkLoader, Reader, default_codec
+
+
+def argparser():
+    from argparse import ArgumentParser
+    ap = ArgumentParser(description='Benchmark makedb insert paths')
+    ap.add_argument('-n', '--number', default=100000, type=int,
+                    help='number of synthetic records (default 100000)')
+    ap.add_argument('-l', '--length', default=1200, type=int,
+                    help='synthetic record length in characters')
+    ap.add_argument('-i', '--input', metavar='TGZ', default=None,
+                    help='use members of TGZ instead of synthetic records')
+    ap.add_argument('-d', '--dir', default=None,
+                    help='directory for temporary databases')
+    ap.add_argument('-r', '--reads', default=10000, type=int,
+                    help='number of random reads (default 10000)')
+    return ap
+
+
+def synthetic_records(count, length, seed=0):
+    rng = random.Random(seed)
+    words = ['protein', 'cell', 'expression', 'patients', 'the', 'of',
+             'and', 'in', 'with', 'increased', 'tumour', 'binding', 'was',
+             'significantly', 'receptor', 'gene', 'mice', 'activity']
+    for i in range(count):
+        text, n = [], 0
+        while n < length:
+            w = rng.choice(words)
+            text.append(w)
+            n += len(w) + 1
+        yield '{}.txt'.format(10000000+i), ' '.join(text)
+
+
+def tgz_records(path):
+    with tarfile.open(path, 'r|gz') as tar:
+        for m in tar:
+            tar.members = []    # as in makedb.process_tgz()
+            if m.isfile():
+                yield (os.path.basename(m.name),
+                       tar.extractfile(m).read().decode('utf-8'))
+
+
+def load_sqlitedict(dbname, records):
+    import sqlitedict
+    with sqlitedict.SqliteDict(dbname, autocommit=True) as db:
+        for key, content in records:
+            db[key] = content
+        db.commit()
+
+
+def load_bulk(dbname, records, codec=None):
+    with BulkLoader(dbname, codec=codec) as db:
+        for key, content in records:
+            db[key] = content
+
+
+def load_compressed(dbname, records):
+    load_bulk(dbname, records, default_codec())
+
+
+def read_random(dbname, keys):
+    with Reader(dbname) as db:
+        for key in keys:
+            db[key]
+
+
+def benchmark(name, load, records, directory, read_keys=None):
+    with tempfile.TemporaryDirectory(dir=directory) as tmpdir:
+        dbname = os.path.join(tmpdir, 'bench.sqlite')
+        start = time()
+        load(dbname, records)
+        elapsed = time() - start
+        rate = len(records)/elapsed
+        size = os.path.getsize(dbname)
+        print('{}\t{} rows\t{:.2f}s\t{:.0f} rows/s\t{:.1f} MB'.format(
+            name, len(records), elapsed, rate, size/2**20))
+        if read_keys:
+            start = time()
+            read_random(dbname, read_keys)
+            elapsed = time() - start
+            print('{} read\t{} reads\t{:.2f}s\t{:.0f} reads/s'.format(
+                name, len(read_keys), elapsed, len(read_keys)/elapsed))
+    return rate
+
+
+def main(argv):
+    args = argparser().parse_args(argv[1:])
+    if args.input is not None:
+        records = list(tgz_records(args.input))
+    else:
+        records = list(synthetic_records(args.number, args.length))
+
+    rates = {}
+    try:
+        rates['sqlitedict'] = benchmark('sqlitedict', load_sqlitedict,
+                                        records, args.dir)
+    except ImportError:
+        warning('sqlitedict not available, skipping baseline')
+    rng = random.Random(0)
+    read_keys = [rng.choice(records)[0] for _ in range(args.reads)]
+    rates['bulk'] = benchmark('bulk', load_bulk, records, args.dir,
+                              read_keys)
+    benchmark('bulk+' + default_codec(), load_compressed, records, args.dir,
+              read_keys)
+    if 'sqlitedict' in rates:
+        print('speedup\t{:.1f}x'.format(rates['bulk']/rates['sqlitedict']))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv))
@@ -0,0 +1,95 @@
+#!/usr/bin/env python3
+
+# Compare Citation.from_xml and skip_citation with condition counting
+# (extractTIABs.note) against formatting a log message for each
+# condition as extractTIABs.py used to, with logging at the default
+# level so that the messages are not output.
+#
+# The two variants are run alternately, starting with a different one
+# in each round, so that warm-up and drift affect both equally.
+
+import os
+import sys
+import tempfile
+import statistics
+
+from time import perf_counter
+from logging import info
+
+BENCHMARK_DIR = os.path.dirname(os.path.abspath(__file__))
+
+sys.path.insert(0, os.path.join(BENCHMARK_DIR, os.pardir))
+
+import extractTIABs
+import synthxml
+
+from bench_pipeline import load_elements
+
+
+def argparser():
+    from argparse import ArgumentParser
+    ap = ArgumentParser(description='Benchmark condition logging')
+    ap.add_argument('-n', '--number', default=20000, type=int,
+                    help='number of synthetic citations (default 20000)')
+    ap.add_argument('-r', '--repeat', default=10, type=int,
+                    help='number of rounds (default 10)')
+    return ap
+
+
+def eager_note(condition, PMID):
+    info('%s in %s' % (condition, PMID))
+
+
+def run(elements, options):
+    for e in elements:
+        if not extractTIABs.skip_citation(e, options):
+            extractTIABs.Citation.from_xml(e)
+
+
+def timed(elements, options, note):
+    """Return time to run with extractTIABs.note replaced by note."""
+    original = extractTIABs.note
+    extractTIABs.note = note
+    try:
+        start = perf_counter()
+        run(elements, options)
+        return perf_counter() - start
+    finally:
+        extractTIABs.note = original
+
+
+def main(argv):
+    args = argparser().parse_args(argv[1:])
+    with tempfile.TemporaryDirectory() as tmpdir:
+        xmlfn = os.path.join(tmpdir, 'synthetic.xml')
+        synthxml.write_file(xmlfn, args.number)
+        elements = load_elements(xmlfn)
+    options = extractTIABs.process_options(
+        ['extractTIABs.py', '-ha', '-gt', str(10000000 + args.number // 10),
+         xmlfn])
+
+    variants = [('counted', extractTIABs.note), ('eager format', eager_note)]
+    times = { name: [] for name, note in variants }
+    timed(elements, options, extractTIABs.note)    # warm-up
+    extractTIABs.condition_counts.clear()
+    for i in range(args.repeat):
+        order = variants if i % 2 == 0 else variants[::-1]
+        for name, note in order:
+            times[name].append(timed(elements, options, note))
+
+    print('{} citations, {} conditions noted per run, {} rounds'.format(
+        len(elements),
+        sum(extractTIABs.condition_counts.values()) // args.repeat,
+        args.repeat))
+    for name, note in variants:
+        t = times[name]
+        print('{}\tmin {:.3f}s\tmedian {:.3f}s\tmax {:.3f}s'.format(
+            name, min(t), statistics.median(t), max(t)))
+    ratios = [e / c for e, c in zip(times['eager format'], times['counted'])]
+    print('speedup\tmedian {:.2f}x\trange {:.2f}x-{:.2f}x'.format(
+        statistics.median(ratios), min(ratios), max(ratios)))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv))
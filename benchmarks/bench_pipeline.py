@@ -0,0 +1,242 @@
+#!/usr/bin/env python3
+
+# Benchmark extractTIABs.py processing stages separately and end to
+# end on synthetic PubMed XML (see synthxml.py).
+#
+# Results are appended to a JSON lines file together with the git
+# commit so that runs on different commits can be compared; with -c,
+# each result is compared to the latest result for the same benchmark
+# and input size from another commit.
+
+import os
+import sys
+import json
+import copy
+import tarfile
+import platform
+import subprocess
+import tempfile
+
+from time import perf_counter, time
+from logging import warning
+
+BENCHMARK_DIR = os.path.dirname(os.path.abspath(__file__))
+
+sys.path.insert(0, os.path.join(BENCHMARK_DIR, os.pardir))
+
+import extractTIABs
+import synthxml
+
+from citationdb import BulkLoader
+
+
+DEFAULT_RESULTS = os.path.join(BENCHMARK_DIR, 'results.jsonl')
+
+# Transform processes for the -tp end-to-end runs
+TRANSFORM_PROCESSES = max(2, os.cpu_count() or 1)
+
+# Option sets for end-to-end runs
+END_TO_END = [
+    ('e2e text', []),
+    ('e2e text -m -mh -s', ['-m', '-mh', '-s']),
+    ('e2e json -jc', ['-jc', '-m', '-mh', '-s']),
+    ('e2e ascii -a -tt', ['-a', '-tt']),
+    ('e2e ascii -a -tt -pp', ['-a', '-tt', '-pp']),
+    ('e2e ascii -a -tt -tp %d' % TRANSFORM_PROCESSES,
+     ['-a', '-tt', '-tp', str(TRANSFORM_PROCESSES)]),
+    ('e2e tgz -z', ['-z']),
+    ('e2e stdout', ['-o', '-']),
+]
+
+
+def argparser():
+    from argparse import ArgumentParser
+    ap = ArgumentParser(description='Benchmark extractTIABs.py stages')
+    ap.add_argument('-n', '--number', default=10000, type=int,
+                    help='number of synthetic citations (default 10000)')
+    ap.add_argument('-r', '--repeat', default=3, type=int,
+                    help='number of repetitions, best is reported')
+    ap.add_argument('-b', '--benchmarks', metavar='PREFIX', nargs='+',
+                    default=None, help='only run benchmarks with names '
+                    'starting with PREFIX')
+    ap.add_argument('-o', '--results', metavar='FILE', default=DEFAULT_RESULTS,
+                    help='file to append results to (default %s)' %
+                    os.path.relpath(DEFAULT_RESULTS))
+    ap.add_argument('-N', '--no-save', default=False, action='store_true',
+                    help='do not save results')
+    ap.add_argument('-c', '--compare', default=False, action='store_true',
+                    help='compare to latest results from another commit')
+    ap.add_argument('-d', '--dir', default=None,
+                    help='directory for temporary files')
+    return ap
+
+
+def git_commit():
+    try:
+        return subprocess.check_output(
+            ['git', 'rev-parse', '--short', 'HEAD'], cwd=BENCHMARK_DIR,
+            stderr=subprocess.DEVNULL).decode('ascii').strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def best_time(func, setup=None, repeat=3):
+    """Return best time of func(setup()) over repeat runs, setup untimed."""
+    best = None
+    for i in range(repeat):
+        arg = setup() if setup is not None else None
+        start = perf_counter()
+        if setup is not None:
+            func(arg)
+        else:
+            func()
+        elapsed = perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def load_elements(fn):
+    """Return list of MedlineCitation elements in fn."""
+    elements = []
+    for event, element in extractTIABs.ET.iterparse(fn):
+        if element.tag == 'MedlineCitation':
+            elements.append(element)
+    return elements
+
+
+def parse(fn):
+    count = 0
+    for event, element in extractTIABs.ET.iterparse(fn):
+        if element.tag == 'MedlineCitation':
+            count += 1
+            element.clear()
+    return count
+
+
+def stage_benchmarks(xmlfn, tmpdir):
+    """Yield (name, func, setup) for individual stages."""
+    options = extractTIABs.process_options(
+        ['extractTIABs.py', '-m', '-mh', '-s', xmlfn])
+    elements = load_elements(xmlfn)
+    Citation = extractTIABs.Citation
+    citations = [Citation.from_xml(e) for e in elements]
+
+    def fresh():
+        # stages modifying citations get unmodified copies
+        return copy.deepcopy(citations)
+
+    def each(func):
+        def run(citations):
+            for c in citations:
+                func(c)
+        return run
+
+    yield 'parse', lambda: parse(xmlfn), None
+    yield 'from_xml', lambda: [Citation.from_xml(e) for e in elements], None
+    extractTIABs.to_ascii('')    # load mapping
+    extractTIABs.citation_to_ascii(copy.deepcopy(citations[0]))
+    yield 'to_ascii', each(extractTIABs.citation_to_ascii), fresh
+    try:
+        extractTIABs.citation_ssplit(copy.deepcopy(citations[0]))
+        yield 'ssplit', each(extractTIABs.citation_ssplit), fresh
+    except ImportError as e:
+        warning('skipping ssplit: {}'.format(e))
+    yield 'tokenize', each(extractTIABs.citation_tokenize), fresh
+    yield 'serialize text', lambda: [c.text(options) for c in citations], None
+    yield 'serialize json', lambda: [
+        extractTIABs.serialize_json(c.to_dict(options), options)
+        for c in citations], None
+    texts = [(c.PMID + '.txt', c.text(options)) for c in citations]
+
+    def write_tar():
+        with tarfile.open(os.path.join(tmpdir, 'bench.tar.gz'), 'w:gz') as t:
+            for name, text in texts:
+                extractTIABs.save_in_tar(t, name, text)
+    yield 'tar write', write_tar, None
+
+    def insert_db():
+        dbname = os.path.join(tmpdir, 'bench.sqlite')
+        if os.path.exists(dbname):
+            os.remove(dbname)
+        with BulkLoader(dbname) as db:
+            for name, text in texts:
+                db[name] = text
+    yield 'makedb insert', insert_db, None
+
+
+def end_to_end_benchmarks(xmlfn, tmpdir):
+    """Yield (name, func, setup) for extractTIABs.py runs."""
+    script = os.path.join(BENCHMARK_DIR, os.pardir, 'extractTIABs.py')
+    for name, args in END_TO_END:
+        def run(outdir, args=args):
+            if '-o' not in args:
+                args = args + ['-o', outdir]
+            with open(os.devnull, 'w') as devnull:
+                subprocess.check_call([sys.executable, script] + args +
+                                      [xmlfn], stdout=devnull,
+                                      stderr=devnull)
+        def setup():
+            return tempfile.mkdtemp(dir=tmpdir)
+        yield name, run, setup
+
+
+def read_results(fn):
+    results = []
+    if os.path.exists(fn):
+        with open(fn) as f:
+            for l in f:
+                results.append(json.loads(l))
+    return results
+
+
+def previous_result(results, result):
+    """Return latest result for same benchmark from another commit."""
+    for r in reversed(results):
+        if (r['benchmark'] == result['benchmark'] and
+            r['citations'] == result['citations'] and
+            r['commit'] != result['commit']):
+            return r
+    return None
+
+
+def main(argv):
+    args = argparser().parse_args(argv[1:])
+    previous = read_results(args.results) if args.compare else []
+    commit = git_commit()
+    results = []
+    with tempfile.TemporaryDirectory(dir=args.dir) as tmpdir:
+        xmlfn = os.path.join(tmpdir, 'synthetic.xml')
+        synthxml.write_file(xmlfn, args.number)
+        benchmarks = list(stage_benchmarks(xmlfn, tmpdir))
+        benchmarks.extend(end_to_end_benchmarks(xmlfn, tmpdir))
+        for name, func, setup in benchmarks:
+            if args.benchmarks and not any(name.startswith(p)
+                                           for p in args.benchmarks):
+                continue
+            elapsed = best_time(func, setup, args.repeat)
+            result = {
+                'benchmark': name,
+                'citations': args.number,
+                'seconds': elapsed,
+                'rate': args.number / elapsed,
+                'commit': commit,
+                'python': platform.python_version(),
+                'time': time(),
+            }
+            results.append(result)
+            line = '{}\t{:.3f}s\t{:.0f} citations/s'.format(
+                name, elapsed, result['rate'])
+            prev = previous_result(previous, result)
+            if prev is not None:
+                line += '\t{:+.1f}% vs {}'.format(
+                    100 * (result['rate'] / prev['rate'] - 1), prev['commit'])
+            print(line)
+    if not args.no_save:
+        with open(args.results, 'a') as out:
+            for result in results:
+                print(json.dumps(result, sort_keys=True), file=out)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv))
@@ -0,0 +1,214 @@
+#!/usr/bin/env python3
+
+# Generate synthetic PubMed distribution-style XML for benchmarking.
+#
+# Output is deterministic for a given seed and count. Citations have
+# structured and unstructured abstracts, MeSH headings with qualifiers,
+# chemicals, DateCreated/DateCompleted, PubDate as Year/Month or
+# MedlineDate, electronic ArticleDates and non-ASCII text, with
+# proportions loosely following recent MEDLINE baseline files.
+
+import io
+import sys
+import gzip
+import random
+
+from xml.sax.saxutils import escape
+
+
+WORDS = [
+    'the', 'of', 'and', 'in', 'to', 'a', 'with', 'was', 'were', 'for',
+    'patients', 'cells', 'protein', 'expression', 'increased', 'study',
+    'treatment', 'activity', 'levels', 'significantly', 'receptor',
+    'gene', 'mice', 'tumour', 'binding', 'clinical', 'results', 'effect',
+    'analysis', 'associated', 'response', 'human', 'cancer', 'disease',
+    'induced', 'function', 'therapy', 'observed', 'compared', 'risk',
+]
+
+# Non-ASCII words, mostly with mappings in entities.dat
+UNICODE_WORDS = [
+    'α-synuclein', 'β-catenin', 'γ-secretase', 'TNF-α', 'Sjögren',
+    'Ménière', 'naïve', 'µg/ml', '37 °C', '≥ 65', '± 2.1', 'Kaplan–Meier',
+    'IL-1β', 'Δ9-THC', 'Müller', 'café', '5′-UTR', 'Gram‐negative',
+]
+
+LABELS = ['BACKGROUND', 'OBJECTIVE', 'METHODS', 'RESULTS', 'CONCLUSIONS']
+
+QUALIFIERS = [
+    ('Q000378', 'metabolism'), ('Q000473', 'pathology'),
+    ('Q000188', 'drug therapy'), ('Q000235', 'genetics'),
+    ('Q000502', 'physiology'), ('Q000097', 'blood'),
+]
+
+MONTHS = ['Jan', 'Feb', 'Mar', 'Apr', 'May', 'Jun', 'Jul', 'Aug', 'Sep',
+          'Oct', 'Nov', 'Dec']
+
+SEASONS = ['Spring', 'Summer', 'Fall', 'Winter']
+
+
+def argparser():
+    from argparse import ArgumentParser
+    ap = ArgumentParser(description='Generate synthetic PubMed XML')
+    ap.add_argument('-n', '--number', default=10000, type=int,
+                    help='number of citations (default 10000)')
+    ap.add_argument('-s', '--seed', default=0, type=int,
+                    help='random seed (default 0)')
+    ap.add_argument('-p', '--first-pmid', default=10000000, type=int,
+                    help='PMID of first citation (default 10000000)')
+    ap.add_argument('output', help='output file (.gz for gzip)')
+    return ap
+
+
+class Generator(object):
+
+    def __init__(self, seed=0):
+        self.rng = random.Random(seed)
+        # fixed vocabularies of descriptors and chemicals
+        self.descriptors = [('D%06d' % (1000 + i), self.phrase(1, 3).title())
+                            for i in range(2000)]
+        self.chemicals = [('C%06d' % (5000 + i), self.phrase(1, 2),
+                           '%d-%02d-%d' % (100 + i, i % 100, i % 10))
+                          for i in range(500)]
+
+    def word(self):
+        if self.rng.random() < 0.02:
+            return self.rng.choice(UNICODE_WORDS)
+        else:
+            return self.rng.choice(WORDS)
+
+    def phrase(self, low, high):
+        return ' '.join(self.word() for _ in range(self.rng.randint(low, high)))
+
+    def sentence(self):
+        s = self.phrase(8, 30)
+        return s[0].upper() + s[1:] + '.'
+
+    def paragraph(self, low, high):
+        return ' '.join(self.sentence()
+                        for _ in range(self.rng.randint(low, high)))
+
+    def date(self, tag, year, full=True, attrs=''):
+        parts = ['<Year>%d</Year>' % year]
+        if full or self.rng.random() < 0.7:
+            parts.append('<Month>%02d</Month>' % self.rng.randint(1, 12))
+            if full or self.rng.random() < 0.5:
+                parts.append('<Day>%02d</Day>' % self.rng.randint(1, 28))
+        return '<%s%s>%s</%s>' % (tag, attrs, ''.join(parts), tag)
+
+    def pubdate(self, year):
+        r = self.rng.random()
+        if r < 0.85:
+            month = self.rng.choice(MONTHS)
+            return ('<PubDate><Year>%d</Year><Month>%s</Month></PubDate>' %
+                    (year, month))
+        elif r < 0.95:
+            return '<PubDate><Year>%d</Year></PubDate>' % year
+        elif r < 0.98:
+            return ('<PubDate><MedlineDate>%d %s-%s</MedlineDate></PubDate>' %
+                    (year, self.rng.choice(MONTHS), self.rng.choice(MONTHS)))
+        else:
+            return ('<PubDate><MedlineDate>%s %d</MedlineDate></PubDate>' %
+                    (self.rng.choice(SEASONS), year))
+
+    def abstract(self):
+        r = self.rng.random()
+        if r < 0.15:
+            return ''
+        elif r < 0.55:
+            # structured
+            labels = LABELS[:self.rng.randint(3, len(LABELS))]
+            texts = ['<AbstractText Label="%s" NlmCategory="%s">%s'
+                     '</AbstractText>' % (l, l, escape(self.paragraph(1, 4)))
+                     for l in labels]
+        else:
+            texts = ['<AbstractText>%s</AbstractText>' %
+                     escape(self.paragraph(4, 10))]
+        return '<Abstract>%s</Abstract>' % ''.join(texts)
+
+    def mesh(self):
+        if self.rng.random() < 0.1:
+            return ''
+        headings = []
+        for d in self.rng.sample(self.descriptors, self.rng.randint(3, 15)):
+            quals = ''.join(
+                '<QualifierName UI="%s" MajorTopicYN="%s">%s'
+                '</QualifierName>' % (q[0], self.yn(0.2), q[1])
+                for q in self.rng.sample(QUALIFIERS, self.rng.randint(0, 2)))
+            headings.append(
+                '<MeshHeading><DescriptorName UI="%s" MajorTopicYN="%s">%s'
+                '</DescriptorName>%s</MeshHeading>' % (
+                    d[0], self.yn(0.25), escape(d[1]), quals))
+        return '<MeshHeadingList>%s</MeshHeadingList>' % ''.join(headings)
+
+    def chemicals_list(self):
+        if self.rng.random() < 0.5:
+            return ''
+        chemicals = self.rng.sample(self.chemicals, self.rng.randint(1, 6))
+        return '<ChemicalList>%s</ChemicalList>' % ''.join(
+            '<Chemical><RegistryNumber>%s</RegistryNumber>'
+            '<NameOfSubstance UI="%s">%s</NameOfSubstance></Chemical>' % (
+                c[2], c[0], escape(c[1]))
+            for c in chemicals)
+
+    def yn(self, p):
+        return 'Y' if self.rng.random() < p else 'N'
+
+    def citation(self, PMID):
+        year = self.rng.randint(1960, 2024)
+        parts = [
+            '<MedlineCitation Owner="NLM" Status="MEDLINE">',
+            '<PMID Version="1">%d</PMID>' % PMID,
+            self.date('DateCreated', year + 1),
+        ]
+        if self.rng.random() < 0.8:
+            parts.append(self.date('DateCompleted', year + 1))
+        parts.extend([
+            '<Article PubModel="Print">',
+            '<Journal><JournalIssue>%s</JournalIssue></Journal>' %
+            self.pubdate(year),
+            '<ArticleTitle>%s</ArticleTitle>' % escape(self.sentence()),
+            self.abstract(),
+        ])
+        if self.rng.random() < 0.3:
+            parts.append(self.date('ArticleDate', year,
+                                   attrs=' DateType="Electronic"'))
+        parts.extend([
+            '</Article>',
+            self.chemicals_list(),
+            self.mesh(),
+            '</MedlineCitation>',
+        ])
+        return ''.join(parts)
+
+
+def generate(out, count, seed=0, first_pmid=10000000):
+    """Write count synthetic citations as XML text to out."""
+    generator = Generator(seed)
+    out.write('<?xml version="1.0" encoding="utf-8"?>\n<MedlineCitationSet>\n')
+    for i in range(count):
+        out.write(generator.citation(first_pmid + i))
+        out.write('\n')
+    out.write('</MedlineCitationSet>\n')
+
+
+def write_file(fn, count, seed=0, first_pmid=10000000):
+    """Write count synthetic citations into fn, gzipped if .gz."""
+    if fn.endswith('.gz'):
+        # mtime=0 for byte-identical output
+        with open(fn, 'wb') as raw:
+            with gzip.GzipFile(fileobj=raw, mode='wb', mtime=0) as gz:
+                with io.TextIOWrapper(gz, encoding='utf-8') as out:
+                    generate(out, count, seed, first_pmid)
+    else:
+        with open(fn, 'w', encoding='utf-8') as out:
+            generate(out, count, seed, first_pmid)
+
+
+def main(argv):
+    args = argparser().parse_args(argv[1:])
+    write_file(args.output, args.number, args.seed, args.first_pmid)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv))
@@ -0,0 +1,175 @@
+#!/usr/bin/env python
+
+# Check PubMed distribution-style md5 checksums.
+#
+# Files are hashed in parallel, and verified files are recorded in a
+# cache with their size and modification time so that unchanged files
+# are not hashed again on later runs.
+
+import os
+import re
+import sys
+import hashlib
+
+from concurrent.futures import ThreadPoolExecutor
+from logging import info, warning, error
+
+
+DEFAULT_CACHE = os.path.join('~', '.cache', 'pubmed-check-md5.tsv')
+
+BUFFER_SIZE = 4 * 1024 * 1024
+
+MD5_RE = re.compile(r'\b([0-9a-fA-F]{32})\b')
+
+
+def argparser():
+    import argparse
+    ap=argparse.ArgumentParser(description='Check md5 checksums.')
+    ap.add_argument('-c', '--cache', metavar='FILE', default=DEFAULT_CACHE,
+                    help='Verification cache (default %s)' % DEFAULT_CACHE)
+    ap.add_argument('-n', '--no-cache', default=False, action='store_true',
+                    help='Do not read or write the verification cache.')
+    ap.add_argument('-j', '--jobs', default=os.cpu_count(), type=int,
+                    help='Number of files to hash in parallel.')
+    ap.add_argument('-v', '--verbose', default=False, action='store_true',
+                    help='Verbose output.')
+    ap.add_argument('paths', metavar='PATH', nargs='+',
+                    help='Directories with .md5 files, or files to check.')
+    return ap
+
+
+def read_expected(md5fn):
+    """Return md5 from file in "MD5 (name) = HASH" or md5sum format."""
+    with open(md5fn) as f:
+        m = MD5_RE.search(f.read())
+    if not m:
+        raise ValueError('no md5 sum in %s' % md5fn)
+    return m.group(1).lower()
+
+
+def md5sum(fn, buffer_size=BUFFER_SIZE):
+    """Return hex md5 digest of file content."""
+    md5 = hashlib.md5()
+    with open(fn, 'rb', buffering=0) as f:
+        buf = bytearray(buffer_size)
+        view = memoryview(buf)
+        while True:
+            n = f.readinto(buf)
+            if not n:
+                break
+            md5.update(view[:n])    # releases the GIL for large buffers
+    return md5.hexdigest()
+
+
+def file_key(fn):
+    """Return (path, size, mtime) identifying file content for the cache."""
+    st = os.stat(fn)
+    return os.path.abspath(fn), st.st_size, st.st_mtime_ns
+
+
+class VerificationCache(object):
+    """Records (path, size, mtime, md5) of verified files in a TSV file."""
+
+    def __init__(self, fn):
+        self.fn = os.path.expanduser(fn) if fn is not None else None
+        self.verified = {}
+        self.changed = False
+        if self.fn is not None and os.path.exists(self.fn):
+            with open(self.fn, encoding='utf-8') as f:
+                for l in f:
+                    try:
+                        path, size, mtime, md5 = l.rstrip('\n').split('\t')
+                        self.verified[(path, int(size), int(mtime))] = md5
+                    except ValueError:
+                        warning('skipping malformed line in %s' % self.fn)
+
+    def is_verified(self, key, md5):
+        return self.verified.get(key) == md5
+
+    def add(self, key, md5):
+        self.verified[key] = md5
+        self.changed = True
+
+    def save(self):
+        if self.fn is None or not self.changed:
+            return
+        directory = os.path.dirname(self.fn)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        tmpfn = self.fn + '.tmp'
+        with open(tmpfn, 'w', encoding='utf-8') as out:
+            for (path, size, mtime), md5 in sorted(self.verified.items()):
+                print('%s\t%d\t%d\t%s' % (path, size, mtime, md5), file=out)
+        os.replace(tmpfn, self.fn)
+        self.changed = False
+
+
+def find_checks(paths):
+    """Return list of (data file, md5 file) pairs for paths.
+
+    Directories are checked for *.md5 files, and the data file is
+    assumed to be the md5 file name with the suffix stripped. For
+    other paths, PATH.md5 is used.
+    """
+    checks = []
+    for path in paths:
+        if os.path.isdir(path):
+            for md5fn in sorted(os.listdir(path)):
+                if md5fn.endswith('.md5'):
+                    md5fn = os.path.join(path, md5fn)
+                    checks.append((md5fn[:-len('.md5')], md5fn))
+        elif path.endswith('.md5'):
+            checks.append((path[:-len('.md5')], path))
+        else:
+            checks.append((path, path + '.md5'))
+    return checks
+
+
+def verify(checks, cache=None, jobs=None):
+    """Check files against expected md5s.
+
+    Return list of (data file, actual, expected) for mismatches. Files
+    recorded as verified in cache with the same size and modification
+    time are not hashed.
+    """
+    if cache is None:
+        cache = VerificationCache(None)
+    todo = []
+    for fn, md5fn in checks:
+        expected = read_expected(md5fn)
+        key = file_key(fn)
+        if cache.is_verified(key, expected):
+            info('%s verified previously' % fn)
+        else:
+            todo.append((fn, key, expected))
+    mismatches = []
+    with ThreadPoolExecutor(max_workers=jobs) as executor:
+        actuals = executor.map(md5sum, [fn for fn, k, e in todo])
+        for (fn, key, expected), actual in zip(todo, actuals):
+            if actual == expected:
+                info('%s OK' % fn)
+                cache.add(key, actual)
+            else:
+                mismatches.append((fn, actual, expected))
+    cache.save()
+    return mismatches
+
+
+def main(argv):
+    args = argparser().parse_args(argv[1:])
+    if args.verbose:
+        import logging
+        logging.getLogger().setLevel(logging.INFO)
+    cache = VerificationCache(None if args.no_cache else args.cache)
+    try:
+        mismatches = verify(find_checks(args.paths), cache, args.jobs)
+    except (IOError, ValueError) as e:
+        error(str(e))
+        return 1
+    for fn, actual, expected in mismatches:
+        print('Mismatch: %s.md5: %s vs %s' % (fn, actual, expected))
+    return 1 if mismatches else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv))
@@ -0,0 +1,113 @@
+#!/usr/bin/env python
+
+# Checkpoints for resuming interrupted extractTIABs.py runs.
+#
+# The checkpoint is a JSON file recording the input files completed,
+# the number of citations read from the current file (with the PMID of
+# the last one, to detect changed inputs), the state of partially
+# written outputs and the run totals at that point. It is replaced
+# atomically on each save.
+
+import os
+import json
+
+from time import monotonic
+
+from progress import CHECK_EVERY
+
+
+class Checkpoint(object):
+    """Tracks progress of a run and saves it periodically."""
+
+    def __init__(self, path, interval=60, state=None):
+        self.path = path
+        self.interval = interval
+        if state is None:
+            state = { 'completed': [], 'current': None, 'counts': None,
+                      'outputs': {} }
+        self.state = state
+        self.completed = set(state['completed'])
+        self.file = None
+        self.position = 0    # citations read from current file
+        self.PMID = None
+        self.calls = 0
+        self.next_save = monotonic() + interval
+
+    @classmethod
+    def load(cls, path, interval=60):
+        with open(path) as f:
+            return cls(path, interval, json.load(f))
+
+    @property
+    def counts(self):
+        """Totals at the time of the checkpoint, None for a new run."""
+        return self.state['counts']
+
+    @property
+    def outputs(self):
+        """State of outputs shared by all inputs at the checkpoint."""
+        return self.state['outputs']
+
+    def is_completed(self, fn):
+        return fn in self.completed
+
+    def start_file(self, fn):
+        self.file = fn
+        self.position = 0
+        self.PMID = None
+
+    def resume(self):
+        """Return (position, PMID, outputs) to resume the current file at.
+
+        Position is 0 and outputs empty if the file was not started.
+        """
+        current = self.state['current']
+        if current is None or current['file'] != self.file:
+            return 0, None, {}
+        return current['position'], current['PMID'], current['outputs']
+
+    def due(self):
+        """Call once per citation; return True if a save is due."""
+        self.calls += 1
+        if self.calls % CHECK_EVERY:
+            return False
+        return monotonic() >= self.next_save
+
+    def save(self, counts, outputs, file_outputs=None):
+        """Save checkpoint at the current position in the current file.
+
+        outputs is the state of outputs shared by all inputs and
+        file_outputs that of the outputs for the current file.
+        """
+        self.state['current'] = {
+            'file': self.file,
+            'position': self.position,
+            'PMID': self.PMID,
+            'outputs': file_outputs or {},
+        }
+        self.state['counts'] = counts
+        self.state['outputs'] = outputs
+        self.write()
+
+    def complete_file(self, counts, outputs):
+        self.state['completed'].append(self.file)
+        self.completed.add(self.file)
+        self.state['current'] = None
+        self.state['counts'] = counts
+        self.state['outputs'] = outputs
+        self.write()
+        self.file = None
+
+    def write(self):
+        tmppath = self.path + '.tmp'
+        with open(tmppath, 'w') as out:
+            json.dump(self.state, out, indent=2)
+            out.flush()
+            os.fsync(out.fileno())
+        os.replace(tmppath, self.path)
+        self.next_save = monotonic() + self.interval
+
+    def remove(self):
+        """Remove checkpoint file after the run has completed."""
+        if os.path.exists(self.path):
+            os.remove(self.path)
@@ -0,0 +1,569 @@
+#!/usr/bin/env python
+
+# Bulk loading of SQLite key/value databases compatible with the
+# sqlitedict package as used by scripts/makedb.py. Values are pickled
+# and stored in a (key TEXT, value BLOB) table exactly as SqliteDict
+# would store them, so databases written here can be read with
+# SqliteDict and vice versa.
+#
+# Values can optionally be compressed with a dictionary trained on
+# the first values loaded. The codec and dictionary are stored in a
+# separate TABLE_meta table, and reading such databases requires the
+# decoder from this module (see Reader and decoder()).
+#
+# A full-text index over citation titles and abstracts can be built
+# into a TABLE_fts SQLite FTS5 table (see build_fts() and search()).
+
+import os
+import json
+import zlib
+import queue
+import string
+import pickle
+import sqlite3
+import threading
+
+from collections import Counter
+from logging import info, warning
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+
+# sqlitedict default table name
+DEFAULT_TABLE = 'unnamed'
+
+DEFAULT_BATCH_SIZE = 10000
+
+DEFAULT_PAGE_SIZE = 16384
+
+# Page cache size in KiB (negative value to PRAGMA cache_size)
+DEFAULT_CACHE_SIZE = 256 * 1024
+
+# Number of values to train the compression dictionary on
+DEFAULT_SAMPLE_SIZE = 10000
+
+DEFAULT_DICT_SIZE = 112640
+
+# zlib only uses the last 32K of a preset dictionary
+ZLIB_DICT_SIZE = 32768
+
+# FTS5 tokenizer presets. 'gtb' treats all ASCII punctuation as token
+# characters so that only whitespace separates tokens, matching text
+# tokenized with extractTIABs.py -tt (gtbtokenize).
+FTS_TOKENIZERS = {
+    'unicode61': 'unicode61',
+    'porter': 'porter unicode61',
+    'gtb': "unicode61 remove_diacritics 0 tokenchars '%s'" % (
+        string.punctuation.replace("'", "''")),
+}
+
+
+def encode(obj):
+    """Encode value as in sqlitedict."""
+    return sqlite3.Binary(pickle.dumps(obj, protocol=pickle.HIGHEST_PROTOCOL))
+
+
+def decode(obj):
+    """Decode value as in sqlitedict."""
+    return pickle.loads(bytes(obj))
+
+
+class ZlibCodec(object):
+    """zlib compression with a preset dictionary."""
+
+    name = 'zlib'
+
+    def __init__(self, dictionary, level=9):
+        self.dictionary = dictionary
+        self.level = level
+
+    def compress(self, data):
+        c = zlib.compressobj(self.level, zdict=self.dictionary)
+        return c.compress(data) + c.flush()
+
+    def decompress(self, data):
+        d = zlib.decompressobj(zdict=self.dictionary)
+        return d.decompress(data) + d.flush()
+
+    @classmethod
+    def train(cls, samples, size=ZLIB_DICT_SIZE):
+        # zlib has no dictionary training; use frequent words, most
+        # frequent last as matches closer to the data are cheaper.
+        counts = Counter(w for s in samples for w in s.split())
+        words, total = [], 0
+        for w, c in counts.most_common():
+            if c < 2 or total + len(w) + 1 > size:
+                break
+            words.append(w)
+            total += len(w) + 1
+        return cls(b' '.join(reversed(words)))
+
+
+class ZstdCodec(object):
+    """Zstandard compression with a trained dictionary."""
+
+    name = 'zstd'
+
+    def __init__(self, dictionary, level=3):
+        self.dictionary = dictionary
+        self.level = level
+        self.dict_data = zstandard.ZstdCompressionDict(dictionary)
+        # (de)compressor objects are not thread-safe
+        self.local = threading.local()
+
+    def _compressor(self):
+        if not hasattr(self.local, 'compressor'):
+            self.local.compressor = zstandard.ZstdCompressor(
+                level=self.level, dict_data=self.dict_data)
+        return self.local.compressor
+
+    def _decompressor(self):
+        if not hasattr(self.local, 'decompressor'):
+            self.local.decompressor = zstandard.ZstdDecompressor(
+                dict_data=self.dict_data)
+        return self.local.decompressor
+
+    def compress(self, data):
+        return self._compressor().compress(data)
+
+    def decompress(self, data):
+        return self._decompressor().decompress(data)
+
+    @classmethod
+    def train(cls, samples, size=DEFAULT_DICT_SIZE):
+        try:
+            trained = zstandard.train_dictionary(size, samples)
+        except zstandard.ZstdError as e:
+            warning('failed to train dictionary ({}), using none'.format(e))
+            return cls(b'')
+        return cls(trained.as_bytes())
+
+
+codecs = {
+    'zlib': ZlibCodec,
+    'zstd': ZstdCodec,
+}
+
+
+def default_codec():
+    return 'zstd' if zstandard is not None else 'zlib'
+
+
+def get_codec(name):
+    if name == 'zstd' and zstandard is None:
+        raise ImportError('zstd codec requires `pip3 install zstandard`')
+    try:
+        return codecs[name]
+    except KeyError:
+        raise ValueError('unknown codec {}'.format(name))
+
+
+def make_encoder(codec):
+    if codec is None:
+        return encode
+    def encode_compressed(obj):
+        return sqlite3.Binary(codec.compress(
+            pickle.dumps(obj, protocol=pickle.HIGHEST_PROTOCOL)))
+    return encode_compressed
+
+
+def make_decoder(codec):
+    if codec is None:
+        return decode
+    def decode_compressed(obj):
+        return pickle.loads(codec.decompress(bytes(obj)))
+    return decode_compressed
+
+
+def meta_table(table):
+    return '%s_meta' % table
+
+
+def read_meta(conn, table=DEFAULT_TABLE):
+    """Return dict of metadata stored for table."""
+    if not table_exists(conn, meta_table(table)):
+        return {}
+    return dict(conn.execute('SELECT key, value FROM "%s"' % meta_table(table)))
+
+
+def write_meta(conn, items, table=DEFAULT_TABLE):
+    with conn:
+        conn.execute('CREATE TABLE IF NOT EXISTS "%s" '
+                     '(key TEXT PRIMARY KEY, value BLOB)' % meta_table(table))
+        conn.executemany(
+            'REPLACE INTO "%s" (key, value) VALUES (?, ?)' % meta_table(table),
+            items)
+
+
+def read_codec(conn, table=DEFAULT_TABLE):
+    """Return codec stored for table, None if values are not compressed."""
+    meta = read_meta(conn, table)
+    if 'codec' not in meta:
+        return None
+    return get_codec(meta['codec'])(bytes(meta['dictionary']))
+
+
+def write_codec(conn, codec, table=DEFAULT_TABLE):
+    write_meta(conn, [('codec', codec.name),
+                      ('dictionary', sqlite3.Binary(codec.dictionary))], table)
+
+
+def decoder(path, table=DEFAULT_TABLE):
+    """Return value decoding function for database, e.g. for use as
+    SqliteDict(path, decode=decoder(path))."""
+    conn = sqlite3.connect('file:%s?mode=ro' % path, uri=True)
+    try:
+        return make_decoder(read_codec(conn, table))
+    finally:
+        conn.close()
+
+
+def table_exists(conn, table):
+    return conn.execute(
+        "SELECT name FROM sqlite_master WHERE type='table' AND name=?",
+        (table,)).fetchone() is not None
+
+
+def has_unique_index(conn, table):
+    # index_list rows are (seq, name, unique, origin, partial)
+    return any(r[2] for r in conn.execute('PRAGMA index_list("%s")' % table))
+
+
+class BulkLoader(object):
+    """Inserts key/value pairs into SQLite in large batched transactions.
+
+    Supports the subset of the SqliteDict interface used for loading
+    (item assignment and commit()). If the table does not exist, it is
+    created without a key index, which is built in close() after the
+    load. When keys repeat, the last value inserted is kept.
+
+    If codec names a compression codec ('zstd' or 'zlib'), a dictionary
+    is trained on the first sample_size values of a new table. Values
+    added to a table that already has a dictionary use the stored one.
+    """
+
+    def __init__(self, path, table=DEFAULT_TABLE, batch_size=None,
+                 page_size=None, cache_size=None, codec=None,
+                 sample_size=DEFAULT_SAMPLE_SIZE):
+        self.path = path
+        self.table = table
+        self.batch_size = batch_size or DEFAULT_BATCH_SIZE
+        self.sample_size = sample_size
+        self.pending = []
+        self.count = 0
+        self.conn = sqlite3.connect(path)
+        # page_size only takes effect before the database is initialized
+        self.conn.execute('PRAGMA page_size=%d' % (
+            page_size or DEFAULT_PAGE_SIZE))
+        self.conn.execute('PRAGMA journal_mode=WAL')
+        self.conn.execute('PRAGMA synchronous=OFF')
+        self.conn.execute('PRAGMA temp_store=MEMORY')
+        self.conn.execute('PRAGMA cache_size=-%d' % (
+            cache_size or DEFAULT_CACHE_SIZE))
+        if not table_exists(self.conn, table):
+            self.conn.execute(
+                'CREATE TABLE "%s" (key TEXT, value BLOB)' % table)
+            self.codec = None
+            self.train_codec = get_codec(codec) if codec is not None else None
+        else:
+            self.codec = read_codec(self.conn, table)
+            self.train_codec = None
+            if codec is not None and self.codec is None:
+                raise ValueError('cannot compress values added to existing '
+                                 'uncompressed table {}'.format(table))
+        self.encode = make_encoder(self.codec)
+        # Also true for a table left by an interrupted bulk load.
+        self.deferred_index = not has_unique_index(self.conn, table)
+        if self.deferred_index:
+            self.insert = 'INSERT INTO "%s" (key, value) VALUES (?, ?)' % table
+        else:
+            self.insert = 'REPLACE INTO "%s" (key, value) VALUES (?, ?)' % table
+
+    def __setitem__(self, key, value):
+        self.pending.append((key, value))
+        if self.train_codec is not None:
+            if len(self.pending) >= self.sample_size:
+                self.train()
+        elif len(self.pending) >= self.batch_size:
+            self.commit()
+
+    def train(self):
+        """Train compression dictionary on pending values."""
+        info('training {} dictionary on {} values'.format(
+            self.train_codec.name, len(self.pending)))
+        samples = [pickle.dumps(v, protocol=pickle.HIGHEST_PROTOCOL)
+                   for k, v in self.pending]
+        self.codec = self.train_codec.train(samples)
+        self.train_codec = None
+        write_codec(self.conn, self.codec, self.table)
+        self.encode = make_encoder(self.codec)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def commit(self):
+        if not self.pending:
+            return
+        if self.train_codec is not None:
+            self.train()
+        rows = [(k, self.encode(v)) for k, v in self.pending]
+        with self.conn:    # one transaction per batch
+            self.conn.executemany(self.insert, rows)
+        self.count += len(self.pending)
+        self.pending = []
+
+    def build_index(self):
+        info('building key index for {}'.format(self.path))
+        with self.conn:
+            # keep last inserted value for repeated keys
+            deleted = self.conn.execute(
+                'DELETE FROM "{0}" WHERE rowid NOT IN '
+                '(SELECT MAX(rowid) FROM "{0}" GROUP BY key)'.format(
+                    self.table)).rowcount
+            if deleted:
+                warning('removed {} rows with repeated keys'.format(deleted))
+            # sqlitedict declares key as PRIMARY KEY; a unique index
+            # gives the same lookup and REPLACE INTO behavior.
+            self.conn.execute(
+                'CREATE UNIQUE INDEX "{0}_key" ON "{0}" (key)'.format(
+                    self.table))
+        self.deferred_index = False
+
+    def close(self):
+        if self.conn is None:
+            return
+        self.commit()
+        if self.deferred_index:
+            self.build_index()
+        self.conn.execute('PRAGMA wal_checkpoint(TRUNCATE)')
+        self.conn.close()
+        self.conn = None
+
+
+class ThreadedWriter(object):
+    """Feeds key/value pairs to a BulkLoader running in its own thread.
+
+    Item assignment only queues the pair, so the caller does not wait
+    for pickling or SQLite. The queue is bounded to limit memory use
+    when the writer falls behind. Errors in the writer are raised in
+    the caller on the following assignment or close().
+    """
+
+    def __init__(self, path, queue_size=DEFAULT_BATCH_SIZE, **kwargs):
+        self.queue = queue.Queue(maxsize=queue_size)
+        self.error = None
+        self.thread = threading.Thread(target=self._run, args=(path, kwargs),
+                                       daemon=True)
+        self.thread.start()
+
+    def _run(self, path, kwargs):
+        # SQLite connections are bound to the creating thread, so the
+        # loader is created here.
+        done = False
+        try:
+            with BulkLoader(path, **kwargs) as db:
+                while True:
+                    item = self.queue.get()
+                    if item is None:
+                        done = True
+                        break
+                    elif isinstance(item, threading.Event):
+                        db.commit()
+                        item.set()
+                    else:
+                        db[item[0]] = item[1]
+        except BaseException as e:
+            self.error = e
+            # keep consuming so that producers are not blocked
+            while not done:
+                item = self.queue.get()
+                if item is None:
+                    break
+                elif isinstance(item, threading.Event):
+                    item.set()
+
+    def __setitem__(self, key, value):
+        if self.error is not None:
+            raise self.error
+        self.queue.put((key, value))
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def commit(self):
+        """Wait until the pairs assigned so far have been committed."""
+        if self.error is not None:
+            raise self.error
+        committed = threading.Event()
+        self.queue.put(committed)
+        committed.wait()
+        if self.error is not None:
+            raise self.error
+
+    def close(self):
+        if self.thread is None:
+            return
+        self.queue.put(None)
+        self.thread.join()
+        self.thread = None
+        if self.error is not None:
+            raise self.error
+
+
+class Reader(object):
+    """Read-only access to a database written by BulkLoader or SqliteDict.
+
+    Values are decompressed transparently. Safe to share between
+    threads, which use up to pool_size connections concurrently.
+    """
+
+    # SQLITE_MAX_VARIABLE_NUMBER is 999 in older SQLite versions
+    MAX_VARIABLES = 999
+
+    def __init__(self, path, table=DEFAULT_TABLE, pool_size=1):
+        self.path = path
+        self.table = table
+        self.pool = queue.Queue()
+        self.connections = []
+        for i in range(pool_size):
+            conn = sqlite3.connect('file:%s?mode=ro' % path, uri=True,
+                                   check_same_thread=False)
+            self.connections.append(conn)
+            self.pool.put(conn)
+        self.decode = make_decoder(read_codec(self.connections[0], table))
+        self.select = 'SELECT value FROM "%s" WHERE key = ?' % table
+
+    def _execute(self, sql, params=()):
+        """Execute query on a pooled connection and return all rows."""
+        conn = self.pool.get()
+        try:
+            return conn.execute(sql, params).fetchall()
+        finally:
+            self.pool.put(conn)
+
+    def get(self, key, default=None):
+        rows = self._execute(self.select, (key,))
+        return self.decode(rows[0][0]) if rows else default
+
+    def get_many(self, keys):
+        """Return dict with values for keys found in the database."""
+        keys = list(keys)
+        found = {}
+        for i in range(0, len(keys), self.MAX_VARIABLES):
+            chunk = keys[i:i+self.MAX_VARIABLES]
+            rows = self._execute(
+                'SELECT key, value FROM "%s" WHERE key IN (%s)' % (
+                    self.table, ', '.join('?' * len(chunk))), chunk)
+            for key, value in rows:
+                found[key] = self.decode(value)
+        return found
+
+    def __getitem__(self, key):
+        value = self.get(key, self)
+        if value is self:
+            raise KeyError(key)
+        return value
+
+    def __contains__(self, key):
+        return self.get(key, self) is not self
+
+    def keys(self):
+        rows = self._execute('SELECT key FROM "%s" ORDER BY rowid' %
+                             self.table)
+        return [r[0] for r in rows]
+
+    def __len__(self):
+        return self._execute('SELECT COUNT(*) FROM "%s"' % self.table)[0][0]
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def close(self):
+        for conn in self.connections:
+            conn.close()
+
+
+def fts_table(table):
+    return '%s_fts' % table
+
+
+def key_to_pmid(key):
+    return os.path.basename(key).split('.')[0]
+
+
+def title_and_abstract(key, value):
+    """Return title and abstract text from extractTIABs.py output value."""
+    if key.endswith('.json'):
+        obj = json.loads(value)
+        sections = obj.get('abstract', [])
+        abstract = '\n'.join(' '.join(t for t in (s['label'], s['text']) if t)
+                             for s in sections)
+        return obj.get('title', ''), abstract
+    else:
+        # title on the first line (assumes no -ii or -nt)
+        title, _, abstract = value.partition('\n')
+        return title, abstract
+
+
+def build_fts(path, tokenizer='unicode61', table=DEFAULT_TABLE,
+              batch_size=DEFAULT_BATCH_SIZE):
+    """(Re)build full-text index over citation titles and abstracts.
+
+    The index is contentless with rowids matching those of table and
+    should be rebuilt after loading more data.
+    """
+    tokenize = FTS_TOKENIZERS.get(tokenizer, tokenizer)
+    conn = sqlite3.connect(path)
+    decode = make_decoder(read_codec(conn, table))
+    fts = fts_table(table)
+    info('building full-text index {} for {}'.format(fts, path))
+    with conn:
+        conn.execute('DROP TABLE IF EXISTS "%s"' % fts)
+        conn.execute("CREATE VIRTUAL TABLE \"%s\" USING fts5(title, abstract, "
+                     "content='', tokenize=%s)" % (
+                         fts, "'%s'" % tokenize.replace("'", "''")))
+        insert = 'INSERT INTO "%s" (rowid, title, abstract) VALUES (?, ?, ?)' % (
+            fts)
+        rows, count = [], 0
+        for rowid, key, value in conn.execute(
+                'SELECT rowid, key, value FROM "%s"' % table):
+            rows.append((rowid,) + title_and_abstract(key, decode(value)))
+            if len(rows) >= batch_size:
+                conn.executemany(insert, rows)
+                count += len(rows)
+                rows = []
+        conn.executemany(insert, rows)
+        count += len(rows)
+        # merge index segments for faster queries
+        conn.execute('INSERT INTO "%s" ("%s") VALUES (\'optimize\')' % (
+            fts, fts))
+    write_meta(conn, [('fts_tokenizer', tokenizer)], table)
+    conn.close()
+    return count
+
+
+def search(conn, query, limit=10, weights=(1.0, 1.0), table=DEFAULT_TABLE):
+    """Return (PMID, score) pairs matching FTS5 query, best first.
+
+    Scores are BM25 with given title and abstract weights; lower
+    (more negative) is better as in SQLite.
+    """
+    fts = fts_table(table)
+    rows = conn.execute(
+        'SELECT t.key, bm25("{0}", ?, ?) AS score FROM "{0}" '
+        'JOIN "{1}" t ON t.rowid = "{0}".rowid '
+        'WHERE "{0}" MATCH ? ORDER BY score LIMIT ?'.format(fts, table),
+        (weights[0], weights[1], query, limit))
+    return [(key_to_pmid(key), score) for key, score in rows]
@@ -0,0 +1,366 @@
+#!/usr/bin/env python
+
+# Columnar export of citation metadata, MeSH headings and chemicals.
+#
+# Two formats are supported: Parquet (requires pyarrow) with one file
+# per table, and a dependency-free "raw" format with one binary file
+# of fixed-width values per column, dictionary-encoded strings and a
+# JSON manifest. In both, each input file is written as a separate
+# row group, and columns can be loaded or memory-mapped individually.
+#
+# Tables and columns (raw format codes refer to dictionary entries,
+# -1 for missing values):
+#
+#   citations: pmid, year, pubdate, epubdate, created, completed
+#   mesh:      pmid, descriptor, qualifier, descriptor_major,
+#              qualifier_major
+#   chemicals: pmid, chemical
+
+import os
+import sys
+import json
+import mmap
+
+from array import array
+from logging import warning
+
+from pubmedtools import date_year
+
+try:
+    import pyarrow
+    import pyarrow.parquet
+except ImportError:
+    pyarrow = None
+
+
+MANIFEST = 'manifest.json'
+
+# (column, array typecode, dictionary name or None) by table
+COLUMNS = {
+    'citations': [
+        ('pmid', 'q', None),
+        ('year', 'h', None),
+        ('pubdate', 'i', 'date'),
+        ('epubdate', 'i', 'date'),
+        ('created', 'i', 'date'),
+        ('completed', 'i', 'date'),
+    ],
+    'mesh': [
+        ('pmid', 'q', None),
+        ('descriptor', 'i', 'descriptor'),
+        ('qualifier', 'i', 'qualifier'),
+        ('descriptor_major', 'b', None),
+        ('qualifier_major', 'b', None),
+    ],
+    'chemicals': [
+        ('pmid', 'q', None),
+        ('chemical', 'i', 'chemical'),
+    ],
+}
+
+# Fields of dictionary entries
+DICTIONARIES = {
+    'date': ['date'],
+    'descriptor': ['ui', 'name'],
+    'qualifier': ['ui', 'name'],
+    'chemical': ['ui', 'name', 'regnum'],
+}
+
+
+def default_format():
+    return 'parquet' if pyarrow is not None else 'raw'
+
+
+def year(date):
+    y = date_year(date) if date else None
+    return int(y) if y is not None else -1
+
+
+def citation_rows(citation):
+    """Return dict of row tuples by table for Citation, strings unencoded."""
+    pmid = int(citation.PMID)
+    md = citation.metadata
+    rows = {
+        'citations': [(
+            pmid,
+            year(md.get('PubDate')),
+            (md.get('PubDate'),),
+            (md.get('EPubDate'),),
+            (md.get('DateCreated'),),
+            (md.get('DateCompleted'),),
+        )],
+        'mesh': [],
+        'chemicals': [],
+    }
+    for heading in citation.mesh:
+        for d, q in heading.descriptor_qualifier_pairs():
+            rows['mesh'].append((
+                pmid,
+                (d.id, d.name),
+                (q.id, q.name) if q is not None else (None, None),
+                int(d.major),
+                int(q.major) if q is not None else -1,
+            ))
+    for c in citation.chemicals:
+        rows['chemicals'].append((pmid, (c.id, c.name, c.regnum)))
+    return rows
+
+
+class RawWriter(object):
+    """Writes tables as per-column binary files with a JSON manifest."""
+
+    def __init__(self, directory):
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+        path = os.path.join(directory, MANIFEST)
+        if os.path.exists(path):
+            raise FileExistsError('{} exists already'.format(path))
+        self.codes = { d: {} for d in DICTIONARIES }
+        self.entries = { d: [] for d in DICTIONARIES }
+        self.rows = { t: 0 for t in COLUMNS }
+        self.row_groups = { t: [] for t in COLUMNS }
+        self.buffers = None
+        self.source = None
+        # Column files are appended to for each group; without a
+        # manifest, existing ones are left from an interrupted run.
+        for table, cols in COLUMNS.items():
+            for column, typecode, d in cols:
+                open(self.column_path(table, column), 'wb').close()
+
+    def column_path(self, table, column):
+        return os.path.join(self.directory, '{}.{}.bin'.format(table, column))
+
+    def encode(self, dictionary, value):
+        if value[0] is None:
+            return -1
+        codes = self.codes[dictionary]
+        code = codes.get(value)
+        if code is None:
+            code = codes[value] = len(self.entries[dictionary])
+            self.entries[dictionary].append(value)
+        return code
+
+    def begin_group(self, source):
+        self.source = source
+        self.buffers = {
+            t: [array(typecode) for c, typecode, d in cols]
+            for t, cols in COLUMNS.items()
+        }
+
+    def add(self, citation):
+        for table, rows in citation_rows(citation).items():
+            buffers = self.buffers[table]
+            columns = COLUMNS[table]
+            for row in rows:
+                for buf, (c, typecode, d), value in zip(buffers, columns, row):
+                    buf.append(value if d is None else self.encode(d, value))
+
+    def end_group(self):
+        for table, buffers in self.buffers.items():
+            for buf, (column, t, d) in zip(buffers, COLUMNS[table]):
+                with open(self.column_path(table, column), 'ab') as out:
+                    buf.tofile(out)
+            count = len(buffers[0])
+            self.row_groups[table].append({
+                'source': self.source,
+                'start': self.rows[table],
+                'rows': count,
+            })
+            self.rows[table] += count
+        self.buffers = None
+
+    def close(self):
+        dictionaries = {}
+        for name, entries in self.entries.items():
+            fn = '{}.dict.jsonl'.format(name)
+            with open(os.path.join(self.directory, fn), 'w',
+                      encoding='utf-8') as out:
+                for entry in entries:
+                    print(json.dumps(entry), file=out)
+            dictionaries[name] = { 'file': fn, 'fields': DICTIONARIES[name] }
+        manifest = {
+            'format': 'raw',
+            'byteorder': sys.byteorder,
+            'tables': {
+                t: {
+                    'rows': self.rows[t],
+                    'columns': [
+                        {
+                            'name': c,
+                            'file': os.path.basename(self.column_path(t, c)),
+                            'typecode': typecode,
+                            'dictionary': d,
+                        }
+                        for c, typecode, d in cols
+                    ],
+                    'row_groups': self.row_groups[t],
+                }
+                for t, cols in COLUMNS.items()
+            },
+            'dictionaries': dictionaries,
+        }
+        with open(os.path.join(self.directory, MANIFEST), 'w') as out:
+            json.dump(manifest, out, indent=2, sort_keys=True)
+
+
+def parquet_schemas():
+    pa = pyarrow
+    return {
+        'citations': pa.schema([
+            ('pmid', pa.int64()),
+            ('year', pa.int16()),
+            ('pubdate', pa.string()),
+            ('epubdate', pa.string()),
+            ('created', pa.string()),
+            ('completed', pa.string()),
+        ]),
+        'mesh': pa.schema([
+            ('pmid', pa.int64()),
+            ('descriptor_ui', pa.string()),
+            ('descriptor_name', pa.string()),
+            ('qualifier_ui', pa.string()),
+            ('qualifier_name', pa.string()),
+            ('descriptor_major', pa.bool_()),
+            ('qualifier_major', pa.bool_()),
+        ]),
+        'chemicals': pa.schema([
+            ('pmid', pa.int64()),
+            ('chemical_ui', pa.string()),
+            ('chemical_name', pa.string()),
+            ('regnum', pa.string()),
+        ]),
+    }
+
+
+def flatten(row):
+    """Flatten dictionary entry tuples in row into separate values."""
+    flat = []
+    for value in row:
+        if isinstance(value, tuple):
+            flat.extend(value)
+        else:
+            flat.append(value)
+    return flat
+
+
+class ParquetWriter(object):
+    """Writes tables as Parquet files with one row group per input."""
+
+    def __init__(self, directory):
+        if pyarrow is None:
+            raise ImportError('parquet output requires `pip3 install pyarrow`')
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+        self.schemas = parquet_schemas()
+        self.writers = {}
+        for table, schema in self.schemas.items():
+            path = os.path.join(directory, '{}.parquet'.format(table))
+            if os.path.exists(path):
+                raise FileExistsError('{} exists already'.format(path))
+            # dictionary encoding for string columns
+            self.writers[table] = pyarrow.parquet.ParquetWriter(
+                path, schema, use_dictionary=True, compression='zstd')
+        self.columns = None
+
+    def begin_group(self, source):
+        self.columns = {
+            t: { f.name: [] for f in s } for t, s in self.schemas.items()
+        }
+
+    def add(self, citation):
+        for table, rows in citation_rows(citation).items():
+            columns = self.columns[table]
+            names = self.schemas[table].names
+            for row in rows:
+                values = flatten(row)
+                if table == 'mesh':
+                    # major flags; -1 for no qualifier
+                    values[5] = bool(values[5])
+                    values[6] = None if values[6] < 0 else bool(values[6])
+                for name, value in zip(names, values):
+                    columns[name].append(value)
+
+    def end_group(self):
+        for table, columns in self.columns.items():
+            batch = pyarrow.table(columns, schema=self.schemas[table])
+            self.writers[table].write_table(batch,
+                                            row_group_size=max(1, len(batch)))
+        self.columns = None
+
+    def close(self):
+        for writer in self.writers.values():
+            writer.close()
+
+
+def open_writer(directory, format=None):
+    if format is None:
+        format = default_format()
+    if format == 'parquet':
+        return ParquetWriter(directory)
+    elif format == 'raw':
+        return RawWriter(directory)
+    else:
+        raise ValueError('unknown columnar format {}'.format(format))
+
+
+# Reading. Parquet files are read with pyarrow directly, e.g.
+# pyarrow.parquet.read_table(path, columns=[...], memory_map=True).
+
+def read_manifest(directory):
+    with open(os.path.join(directory, MANIFEST)) as f:
+        manifest = json.load(f)
+    if manifest.get('byteorder') != sys.byteorder:
+        warning('{} written with {} byte order'.format(
+            directory, manifest.get('byteorder')))
+    return manifest
+
+
+def column_info(manifest, table, column):
+    for c in manifest['tables'][table]['columns']:
+        if c['name'] == column:
+            return c
+    raise KeyError('no column {} in table {}'.format(column, table))
+
+
+def map_column(directory, table, column, manifest=None):
+    """Return memory-mapped column as a typed memoryview."""
+    if manifest is None:
+        manifest = read_manifest(directory)
+    c = column_info(manifest, table, column)
+    path = os.path.join(directory, c['file'])
+    if os.path.getsize(path) == 0:
+        return memoryview(array(c['typecode']))
+    with open(path, 'rb') as f:
+        m = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    return memoryview(m).cast(c['typecode'])
+
+
+def read_dictionary(directory, name, manifest=None):
+    """Return list of entries for dictionary name."""
+    if manifest is None:
+        manifest = read_manifest(directory)
+    fn = manifest['dictionaries'][name]['file']
+    with open(os.path.join(directory, fn), encoding='utf-8') as f:
+        return [json.loads(l) for l in f]
+
+
+def load_columns(directory, table, columns=None, decode=False):
+    """Return dict of selected columns of table.
+
+    Columns are memory-mapped; with decode=True, dictionary-encoded
+    columns are returned as lists of entries instead of codes.
+    """
+    manifest = read_manifest(directory)
+    if columns is None:
+        columns = [c['name'] for c in manifest['tables'][table]['columns']]
+    loaded, dictionaries = {}, {}
+    for column in columns:
+        values = map_column(directory, table, column, manifest)
+        d = column_info(manifest, table, column)['dictionary']
+        if decode and d is not None:
+            if d not in dictionaries:
+                dictionaries[d] = read_dictionary(directory, d, manifest)
+            entries = dictionaries[d]
+            values = [entries[v] if v >= 0 else None for v in values]
+        loaded[column] = values
+    return loaded
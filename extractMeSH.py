@@ -1,6 +1,8 @@
 #!/usr/bin/env python
 
-# Extract unique ID, name and tree numbers from MeSH XML data.
+# Extract unique ID, name and tree numbers from MeSH XML data
+# (descriptors, desc20XX.xml) or ID, name and heading-mapped descriptor
+# IDs from supplementary concept records (supp20XX.xml).
 
 import sys
 import gzip
@@ -44,6 +46,8 @@ def argparser():
                     help='Output python dictionary (default TSV)')
     ap.add_argument('-b', '--brat-norm', default=False, action='store_true',
                     help='Output brat normalization format (default TSV)')
+    ap.add_argument('-i', '--index', metavar='DB', default=None,
+                    help='Write indexed SQLite database DB (see meshindex.py)')
     ap.add_argument("file", metavar="FILE", help="Input MeSH XML.")
     return ap
 
@@ -93,11 +97,12 @@ def write_trailer(options, out=None):
 class Descriptor(object):
     """MeSH descriptor."""
 
-    def __init__(self, id_, name, scope, treenums):
+    def __init__(self, id_, name, scope, treenums, terms=None):
         self.id = id_
         self.name = name
         self.scope = scope
         self.treenums = treenums
+        self.terms = terms
 
     def to_dict(self, no_id=False):
         d = {
@@ -126,7 +131,52 @@ class Descriptor(object):
         except Exception as e:
             warning('missing tree numbers for %s (%s)' % (uid, name))
             tree_numbers = []
-        return cls(uid, name, scope, [e.text for e in tree_numbers])
+        terms = [e.text for e in element.iterfind(
+            'ConceptList/Concept/TermList/Term/String')]
+        return cls(uid, name, scope, [e.text for e in tree_numbers], terms)
+
+
+class SupplementalRecord(object):
+    """MeSH supplementary concept record (SCR)."""
+
+    def __init__(self, id_, name, scope, descriptors):
+        self.id = id_
+        self.name = name
+        self.scope = scope
+        self.descriptors = descriptors
+
+    def to_dict(self, no_id=False):
+        d = {
+            'name': self.name,
+            'scope': self.scope,
+            'descriptors': self.descriptors
+        }
+        if not no_id:
+            d.update({'_id': self.id })
+        return d
+
+    @classmethod
+    def from_xml(cls, element):
+        uid = find_only(element, 'SupplementalRecordUI').text
+        name_element = find_only(element, 'SupplementalRecordName')
+        name = find_only(name_element, 'String').text
+        notes = element.findall('Note')
+        scope = notes[0].text.strip() if notes and notes[0].text else ''
+        # Heading-mapped descriptor UIs may be marked with a leading
+        # asterisk; only the UI is kept.
+        descriptors = [e.text.lstrip('*') for e in element.iterfind(
+            'HeadingMappedToList/HeadingMappedTo/DescriptorReferredTo/'
+            'DescriptorUI')]
+        if not descriptors:
+            info('no heading mapped to for %s (%s)' % (uid, name))
+        return cls(uid, name, scope, descriptors)
+
+
+# Parsers for supported record types by element tag.
+record_types = {
+    'DescriptorRecord': Descriptor,
+    'SupplementalRecord': SupplementalRecord,
+}
 
 
 def write_data(descriptor, options, out=None):
@@ -155,20 +205,38 @@ def write_data(descriptor, options, out=None):
 write_data.first = True
 
 
-def process_stream(stream, options):
+def process_stream(stream, options, write=write_data):
     for event, element in stream:
-        if event != 'end' or element.tag != 'DescriptorRecord':
+        if event != 'end' or element.tag not in record_types:
             continue
-        write_data(Descriptor.from_xml(element), options)
+        write(record_types[element.tag].from_xml(element), options)
         element.clear()
 
 
-def process(path, options):
+def process(path, options, write=write_data):
     if not path.endswith('.gz'):
-        return process_stream(ET.iterparse(path), options)
+        return process_stream(ET.iterparse(path), options, write)
     else:
         with gzip.GzipFile(path) as stream:
-            return process_stream(ET.iterparse(stream), options)
+            return process_stream(ET.iterparse(stream), options, write)
+
+
+def write_index(options):
+    from meshindex import MeshIndexWriter
+    writer = MeshIndexWriter(options.index)
+
+    def write(record, options):
+        if isinstance(record, SupplementalRecord):
+            writer.add_supplemental(record)
+            return
+        if options.top and 'descriptor' not in writer.kinds:
+            # only with descriptors: the first add recreates their tables
+            for uid, name, treenums in meshtop:
+                writer.add(Descriptor(uid, name, '', treenums))
+        writer.add(record)
+
+    process(options.file, options, write)
+    writer.close()
 
 
 def main(argv):
@@ -177,6 +245,10 @@ def main(argv):
         error('at most one of -j, -d and -b arguments allowed.')
         return 1
 
+    if args.index is not None:
+        write_index(args)
+        return 0
+
     write_header(args)
     if args.top:
         for uid, name, treenums in meshtop:
@@ -4,24 +4,52 @@ import sys
 import os
 import codecs
 import gzip
+import zlib
 import logging
 import tarfile
 import json
+import copy
+import queue
+import threading
 
 from time import time
 from io import StringIO, BytesIO
-from collections import OrderedDict, namedtuple
+from collections import OrderedDict, namedtuple, Counter
+from contextlib import contextmanager
 from logging import error, warning, info
 
 from gtbtokenize import tokenize
+from pubmedtools import (find_only, find_abstract, inner_text, date_year,
+                         pub_year, section_label, mesh_term, substance)
 
 try:
     import xml.etree.ElementTree as ET
 except ImportError:
     import cElementTree as ET
 
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
 
 output_count, skipped_count = 0, 0
+empty_count, missing_ascii_count = 0, 0
+
+# Counts of common conditions in the data by description, see note()
+condition_counts = Counter()
+
+# Option selecting the output that conditions affect, see
+# write_condition_statistics()
+CONDITION_OUTPUTS = {
+    'no MeSH headings': 'mesh_headings',
+    'no chemical list': 'substances',
+    'missing <DateCreated>': 'metadata',
+    'missing <DateCompleted>': 'metadata',
+}
+
+# Citations per pipeline queue item and transform process task
+PIPELINE_BATCH = 100
 
 month_abbr_map = {
     'Jan': '01',
@@ -39,10 +67,6 @@ month_abbr_map = {
 }
 
 
-class FormatError(Exception):
-    pass
-
-
 def argparser():
     import argparse
 
@@ -56,6 +80,10 @@ def argparser():
                     help='Only process citations with IDs in FILE.')
     ap.add_argument('-j', '--json', default=False, action='store_true',
                     help='Output JSON')
+    ap.add_argument('-jc', '--json-compact', default=False,
+                    action='store_true',
+                    help='Output compact JSON without indentation or key '
+                    'sorting (implies -j).')
     ap.add_argument('-ha', '--has-abstract', default=False, action='store_true',
                     help='Only process citations with abstracts.')
     ap.add_argument('-gt', '--PMID-greater-than', metavar='PMID', default=None,
@@ -74,6 +102,43 @@ def argparser():
                     action='store_true', help='Output MeSH headings.')
     ap.add_argument('-mt', '--mesh-trees', default=False, action='store_true',
                     help='Output expanded MeSH trees (implies -mh).')
+    ap.add_argument('-mm', '--memory', default=False, action='store_true',
+                    help='Report peak RSS and live objects for each input.')
+    ap.add_argument('-ms', '--memory-sites', metavar='N', default=0, type=int,
+                    help='Also report top N allocation sites (slow, '
+                    'implies -mm).')
+    ap.add_argument('-ml', '--memory-limit', metavar='MB', default=None,
+                    type=float, help='Warn with PMID range when RSS exceeds '
+                    'MB (implies -mm).')
+    ap.add_argument('-mu', '--mesh-under', metavar='TREEPREFIX', default=None,
+                    action='append',
+                    help='Only process citations with MeSH headings in the '
+                    'subtree TREEPREFIX (e.g. "C04", repeatable).')
+    ap.add_argument('-pf', '--profile', default=False, action='store_true',
+                    help='Report time spent in each processing stage.')
+    ap.add_argument('-pj', '--profile-json', metavar='FILE', default=None,
+                    help='Write per-file stage times as JSON (implies -pf).')
+    ap.add_argument('-pr', '--progress', default=False, action='store_true',
+                    help='Report throughput and ETA periodically to stderr.')
+    ap.add_argument('-pi', '--progress-interval', metavar='SEC', default=30,
+                    type=float, help='Seconds between progress reports.')
+    ap.add_argument('-pm', '--progress-metrics', metavar='FILE', default=None,
+                    help='Write progress metrics to FILE (JSON for .json, '
+                    'Prometheus text format otherwise).')
+    ap.add_argument('-pp', '--pipeline', default=False, action='store_true',
+                    help='Parse, transform and write citations in separate '
+                    'threads.')
+    ap.add_argument('-pq', '--parse-queue', metavar='N', default=1000,
+                    type=int, help='Parsed citations queued for transform '
+                    '(with -pp, default 1000).')
+    ap.add_argument('-oq', '--output-queue', metavar='N', default=1000,
+                    type=int, help='Transformed citations queued for output '
+                    '(with -pp, default 1000).')
+    ap.add_argument('-tp', '--transform-processes', metavar='N', default=0,
+                    type=int, help='Transform citations in N processes '
+                    '(implies -pp).')
+    ap.add_argument('-py', '--pub-year', default=False, action='store_true',
+                    help='Only output PMID<TAB>YEAR (publication year).')
     ap.add_argument('-na', '--no-abstract', default=False, action='store_true',
                     help='Do not output abstracts.')
     ap.add_argument('-nt', '--no-title', default=False, action='store_true',
@@ -86,10 +151,45 @@ def argparser():
                     help='Perform tokenization')
     ap.add_argument('-s', '--substances', default=False, action='store_true',
                     help='Output substances (chemicals).')
+    ap.add_argument('-xs', '--expand-substances', default=False,
+                    action='store_true',
+                    help='Expand supplementary concept substances to mapped '
+                    'descriptors (implies -s, requires -mi).')
+    ap.add_argument('-mi', '--mesh-index', metavar='DB', default=None,
+                    help='MeSH index created with extractMeSH.py --index.')
     ap.add_argument('-o', '--output-dir', metavar='DIR', default='texts',
                     help='Output directory (default "texts\", "-" for stdout)')
+    ap.add_argument('-db', '--database', metavar='DB', default=None,
+                    help='Output into key/value database DB as created by '
+                    'scripts/makedb.py (overrides -o)')
+    ap.add_argument('-ck', '--checkpoint', metavar='FILE', default=None,
+                    help='Save progress in FILE for resuming with --resume.')
+    ap.add_argument('-ci', '--checkpoint-interval', metavar='SEC',
+                    default=60, type=float,
+                    help='Seconds between checkpoints (default 60).')
+    ap.add_argument('-qf', '--quarantine', metavar='FILE', default=None,
+                    help='Continue past citations that fail to process, '
+                    'recording them with the error in FILE (JSON lines). '
+                    'Sharded output is then written synchronously.')
+    ap.add_argument('-rs', '--resume', default=False, action='store_true',
+                    help='Resume run from checkpoint (requires -ck).')
+    ap.add_argument('-cx', '--columnar', metavar='DIR', default=None,
+                    help='Output metadata, MeSH and chemicals as columnar '
+                    'files in DIR (overrides -o).')
+    ap.add_argument('-cf', '--columnar-format', default=None,
+                    choices=['parquet', 'raw'],
+                    help='Columnar format (default parquet if pyarrow is '
+                    'installed, raw otherwise).')
+    ap.add_argument('-vm', '--verify-md5', default=False, action='store_true',
+                    help='Check inputs against FILE.md5 before processing.')
     ap.add_argument('-v', '--verbose', default=False, action='store_true',
                     help='Verbose output.')
+    ap.add_argument('-sd', '--shard-depth', metavar='N', default=0, type=int,
+                    help='Write files into N levels of PMID hash shard '
+                    'directories with a manifest (see filewriter.py).')
+    ap.add_argument('-wt', '--write-threads', metavar='N', default=4,
+                    type=int, help='Threads for writing sharded output '
+                    'files (default 4, 1 to write synchronously).')
     ap.add_argument('-z', '--tgz', default=False, action="store_true",
                     help='Output .tar.gz file')
     ap.add_argument('files', metavar='FILE', nargs='+',
@@ -97,11 +197,6 @@ def argparser():
     return ap
 
 
-def inner_text(element):
-    """Return the catenated text of element and all subelements."""
-    return ''.join(element.itertext())
-
-
 class Citation(object):
     """Represents a PubMed citation."""
 
@@ -186,8 +281,8 @@ class Citation(object):
         for a in abstractTexts:
             try:
                 sections.append(AbstractSection.from_xml(a, PMID))
-            except EmptySection as e:
-                info(str(e))    # happens too often to warn
+            except EmptySection:
+                note('empty unlabelled <AbstractText>', PMID)
         mesh_headings = find_mesh_headings(element, PMID)
         mesh = [MeshHeading.from_xml(h) for h in mesh_headings]
         chemical_list = find_chemicals(element, PMID)
@@ -242,23 +337,16 @@ class AbstractSection(object):
     def from_xml(cls, element, PMID):
         text = inner_text(element)
         if not (text and text.strip() != ''):
-            info('empty text for <AbstractText>s in %s' % PMID)
+            note('empty text for <AbstractText>', PMID)
             text = ''
-        label = element.attrib.get('Label')
-        # The special Label "UNLABELLED" is interpreted as empty.
-        if label == 'UNLABELLED':
-            label = ''
+        label = section_label(element)
         # Empty text and label would imply an empty section. Refuse
         # to create such aberrations.
         if not text and not label:
-            raise EmptySection('empty unlabelled <AbstractText> in %s' % PMID)
+            raise EmptySection(PMID)    # caller notes the condition
         return cls(text, label)
 
 
-Descriptor = namedtuple('Descriptor', 'id name major')
-Qualifier = namedtuple('Qualifier', 'id name major')
-
-
 class MeshHeading(object):
     """Represents a MeSH heading with a Descriptor and optional Qualifiers."""
 
@@ -320,87 +408,75 @@ class MeshHeading(object):
 
     @classmethod
     def from_xml(cls, element):
-        desc = find_only(element, 'DescriptorName')
-        id_ = desc.attrib.get('UI')
-        major = (desc.attrib.get('MajorTopicYN') == 'Y')
-        descriptor = Descriptor(id_, desc.text, major)
-        qualifiers = []
-        for qual in element.findall('QualifierName'):
-            id_ = qual.attrib.get('UI')
-            major = (qual.attrib.get('MajorTopicYN') == 'Y')
-            qualifiers.append(Qualifier(id_, qual.text, major))
-        return cls(descriptor, qualifiers)
+        term = mesh_term(element)
+        return cls(term.descriptor, list(term.qualifiers))
+
+
+MappedDescriptor = namedtuple('MappedDescriptor', 'id name treenums')
 
 
 class Chemical(object):
     """Represents a Chemical entry with a ID, name, and registry number."""
 
-    def __init__(self, id_, name, regnum):
+    def __init__(self, id_, name, regnum, descriptors=None):
         self.id = id_
         self.name = name
         self.regnum = regnum
+        self.descriptors = descriptors if descriptors is not None else []
 
     def text(self, options=None):
         # Note: registry number not represented
-        return '%s (%s)' % (self.id, self.name)
+        text = '%s (%s)' % (self.id, self.name)
+        if options and options.expand_substances and self.descriptors:
+            text += ' => ' + ', '.join('%s (%s)' % (d.id, d.name)
+                                       for d in self.descriptors)
+        return text
 
     def to_dict(self, options=None):
-        return {
+        obj = {
             'id': self.id,
             'name': self.name,
             'regnum': self.regnum
         }
+        if options and options.expand_substances:
+            obj['descriptors'] = [
+                {
+                    'id': d.id,
+                    'name': d.name,
+                    'treenums': d.treenums
+                }
+                for d in self.descriptors
+            ]
+        return obj
 
     @classmethod
     def from_xml(cls, element):
-        id_name = find_only(element, 'NameOfSubstance')
-        id_ = id_name.attrib.get('UI')
-        name = id_name.text
-        regnum = find_only(element, 'RegistryNumber').text
-        return cls(id_, name, regnum)
+        return cls(*substance(element))
 
 
-def find_only(element, match):
-    """Return the only matching child of the given element.
+def note(condition, PMID):
+    """Count common condition in data, logging PMID only if verbose.
 
-    Raise KeyError if no match and FormatError if multiple matches.
+    The conditions are too frequent to warn about and formatting a
+    message for each would slow down processing when not logged.
     """
-    found = element.findall(match)
-    if not found:
-        raise KeyError('Error: expected 1 %s, got %d' % (match, len(found)))
-    elif len(found) > 1:
-        raise FormatError('Error: expected 1 %s, got %d' % (match, len(found)))
-    else:
-        return found[0]
+    condition_counts[condition] += 1
+    if logging.root.isEnabledFor(logging.INFO):
+        info('%s in %s' % (condition, PMID))
 
 
-def find_abstract(citation, PMID):
-    """Return the Abstract element for given Article, or None if none."""
-    # basic case: exactly one <Abstract> in <Article>.
-    article = find_only(citation, 'Article')
-    abstracts = article.findall('Abstract')
-    assert len(abstracts) in (0,1), 'ERROR: %d abstracts for PMID %s' % \
-        (len(abstracts, PMID))
-    abstract = None if not abstracts else abstracts[0]
-
-    # if there's no <Abstract>, look for <OtherAbstract> in English in
-    # the citation (*not* the article).
-    if abstract is None:
-        otherAbstracts = []
-        for o in citation.findall('OtherAbstract'):
-            lang = o.attrib.get('Language')
-            if lang == 'eng':
-                otherAbstracts.append(o)
-            else:
-                warning('Skipping <OtherAbstract Languag="{}">'.format(lang))
-        # This happens a few times.
-        if len(otherAbstracts) > 1:
-            warning('%d "other" abstracts for PMID %s. Only using first.' %
-                    (len(otherAbstracts), PMID))
-        if otherAbstracts != []:
-            abstract = otherAbstracts[0]
+def write_condition_statistics(options, out=sys.stderr):
+    """Write counts of conditions, omitting ones for outputs not selected.
 
-    return abstract
+    Citation.from_xml() reads MeSH headings, chemicals and metadata
+    regardless of options, so their conditions are always counted.
+    """
+    for condition, count in sorted(condition_counts.items()):
+        output = CONDITION_OUTPUTS.get(condition)
+        if (output is not None and not getattr(options, output) and
+            options.columnar is None and not options.verbose):
+            continue
+        print('%s\t%d' % (condition, count), file=out)
 
 
 def find_mesh_headings(citation, PMID, options=None):
@@ -409,7 +485,7 @@ def find_mesh_headings(citation, PMID, options=None):
         return []     # avoid unnecessary load
     heading_lists = citation.findall('MeshHeadingList')
     if not heading_lists:
-        info('no MeSH headings for %s' % PMID)
+        note('no MeSH headings', PMID)
         return []
     assert len(heading_lists) == 1, 'Multiple MeshHeadingLists for %s' % PMID
     headings = heading_lists[0]
@@ -422,7 +498,7 @@ def find_chemicals(citation, PMID, options=None):
         return []    # avoid unnecessary load
     chemical_lists = citation.findall('ChemicalList')
     if not chemical_lists:
-        info('No chemical list for %s' % PMID)
+        note('no chemical list', PMID)
         return []
     assert len(chemical_lists) == 1, 'Multiple ChemicalLists for %s' % PMID
     chemicals = chemical_lists[0]
@@ -478,11 +554,12 @@ def find_metadata(citation, PMID, options=None):
     metadata = OrderedDict()
 
     # PubMed citation dates (if present)
-    for date in ('DateCreated', 'DateCompleted'):
+    for date, missing in (('DateCreated', 'missing <DateCreated>'),
+                          ('DateCompleted', 'missing <DateCompleted>')):
         try:
             element = find_only(citation, date)
         except KeyError:
-            info('missing <%s> in %s' % (date, PMID))
+            note(missing, PMID)
             continue
         metadata[date] = date_string(element, PMID)
 
@@ -500,6 +577,36 @@ def find_metadata(citation, PMID, options=None):
     return metadata
 
 
+def normalize_year(date):
+    """Return year from <PubDate> text such as MedlineDate, None if none."""
+    # The number of distinct MedlineDate strings is small compared to
+    # the number of citations, so results are cached.
+    cache = normalize_year.cache
+    if date not in cache:
+        cache[date] = date_year(date)
+    return cache[date]
+normalize_year.cache = {}
+
+
+def find_pub_year(citation, PMID):
+    """Return publication year of citation, None if not found."""
+    year = pub_year(citation, normalize_year)
+    if year is None:
+        date = citation.findtext('Article//PubDate/MedlineDate')
+        warning('no year in <PubDate> in %s: %s' % (PMID, date))
+    return year
+
+
+def write_pub_year(element, out):
+    """Write PMID<TAB>YEAR for citation element, return False if no year."""
+    PMID = find_only(element, 'PMID').text
+    year = find_pub_year(element, PMID)
+    if year is None:
+        return False
+    out.write('%s\t%s\n' % (PMID, year))
+    return True
+
+
 def tree_number_text(treenum, qualifier, treenum_to_name):
     """Return human-readable text for MeSH treenumber."""
     num = treenum
@@ -533,6 +640,33 @@ def mesh_ancestors(treenum):
     return [treenum[0]] + ['.'.join(parts[:i+1]) for i in range(len(parts))]
 
 
+def in_mesh_subtree(treenum, prefix):
+    """Return True if MeSH tree number is in subtree rooted at prefix."""
+    # Top-level IDs consist of just the first letter (see mesh_ancestors).
+    if len(prefix) == 1:
+        return treenum[0] == prefix
+    return treenum == prefix or treenum.startswith(prefix + '.')
+
+
+def mesh_subtree_ids(prefixes, index=None):
+    """Return set of descriptor UIs with a tree number under any prefix."""
+    if index is not None:
+        return set().union(*[index.ids_under(p) for p in prefixes])
+    uid_to_node, treenum_name = get_mesh_data()
+    ids = set()
+    for uid, node in uid_to_node.items():
+        if any(in_mesh_subtree(t, p)
+               for t in node['treenums'] for p in prefixes):
+            ids.add(uid)
+    return ids
+
+
+def citation_descriptor_ids(citation):
+    """Return descriptor UIs in MeshHeadingList of given citation element."""
+    return [d.attrib.get('UI') for d in
+            citation.iterfind('MeshHeadingList/MeshHeading/DescriptorName')]
+
+
 def skip_pmid(PMID, options):
     """Return True if PMID should be skipped by options, False otherwise."""
     PMID = int(PMID)
@@ -540,11 +674,10 @@ def skip_pmid(PMID, options):
          PMID <= options.PMID_greater_than) or
         (options.PMID_lower_than is not None and
          PMID >= options.PMID_lower_than)):
-        info('skipping %d (limits %d-%d)' %
-             (PMID, options.PMID_greater_than, options.PMID_lower_than))
+        note('skipped (outside PMID limits)', PMID)
         return True
     elif options.ids is not None and PMID not in options.ids:
-        info('skipping %d (not in given IDs)' % PMID)
+        note('skipped (not in given IDs)', PMID)
         return True
     else:
         return False
@@ -556,8 +689,13 @@ def skip_citation(element, options):
     PMID = find_only(element, 'PMID').text
     if skip_pmid(PMID, options):
         return True
+    elif (options.mesh_under is not None and
+          not any(i in options.mesh_under_ids
+                  for i in citation_descriptor_ids(element))):
+        note('skipped (not under given MeSH trees)', PMID)
+        return True
     elif options.has_abstract and find_abstract(element, PMID) is None:
-        info('skipping %s (no abstract)' % PMID)
+        note('skipped (no abstract)', PMID)
         return True
     else:
         return False
@@ -618,6 +756,28 @@ def citation_ssplit(citation):
 citation_ssplit.ssplitter = None
 
 
+def expand_substance(ui, index):
+    """Return descriptors mapped to substance UI in MeSH index."""
+    # Substance UIs repeat heavily across citations, cache lookups.
+    cache = expand_substance.cache
+    if ui not in cache:
+        if ui is None or not ui.startswith('C'):
+            cache[ui] = []    # not a supplementary concept record
+        else:
+            cache[ui] = [MappedDescriptor(d, index.name(d), index.treenums(d))
+                         for d in index.heading_mapped(ui)]
+            if not cache[ui]:
+                info('no descriptors mapped to %s' % ui)
+    return cache[ui]
+expand_substance.cache = {}
+
+
+def citation_expand_substances(citation, index):
+    """Add descriptors mapped from supplementary records to chemicals."""
+    for chemical in citation.chemicals:
+        chemical.descriptors = expand_substance(chemical.id, index)
+
+
 def tokenize_multiline(text):
     return '\n'.join(tokenize(s) for s in text.split('\n'))
 
@@ -637,32 +797,99 @@ def save_in_tar(tar, name, text):
     tar.addfile(info, BytesIO(data))
 
 
-def write_citation(directory, name, outfile, citation, options):
+def compact_json_dumps(obj):
+    """Return compact JSON for obj with keys in insertion order."""
+    if orjson is not None:
+        return orjson.dumps(obj).decode('utf-8')
+    else:
+        return json.dumps(obj, ensure_ascii=False, separators=(',', ':'))
+
+
+def serialize_json(obj, options):
+    if options.json_compact:
+        return compact_json_dumps(obj)
+    else:
+        return json.dumps(obj, sort_keys=True, indent=2,
+                          separators=(',', ': '))
+
+
+def run_stage(options, stage, func, *args):
+    """Call func(*args), timing it as stage when profiling."""
+    if options.profiler is None:
+        return func(*args)
+    else:
+        return options.profiler.run(stage, func, *args)
+
+
+def serialize_citation(citation, options):
+    if not options.json:
+        return citation.text(options)
+    else:
+        return serialize_json(citation.to_dict(options), options)
+
+
+def transform_citation(citation, options):
+    """Apply text transformations to citation and serialize it.
+
+    Return (text, missing), where missing is the number of characters
+    without an ASCII mapping and text is None if the citation should
+    not be output.
+    """
+    missing = 0
+    if options.expand_substances:
+        run_stage(options, 'expand', citation_expand_substances, citation,
+                  options.mesh_index)
     if options.ascii:
-        missing = citation_to_ascii(citation)
+        missing = run_stage(options, 'to_ascii', citation_to_ascii, citation)
         if options.ascii_missing and not missing:
-            return
+            return None, missing
     if options.ssplit:
-        citation_ssplit(citation)
+        run_stage(options, 'ssplit', citation_ssplit, citation)
     if options.tokenize:
-        citation_tokenize(citation)
-    if not options.json:
-        text = citation.text(options)
+        run_stage(options, 'tokenize', citation_tokenize, citation)
+    text = run_stage(options, 'serialize', serialize_citation, citation,
+                     options)
+    return text, missing
+
+
+def write_citation(directory, name, outfile, citation, options):
+    if options.columnar is not None:
+        run_stage(options, 'write', outfile.add, citation)
     else:
-        text = json.dumps(citation.to_dict(options), sort_keys=True,
-                          indent=2, separators=(',', ': '))
-    if directory is None:
+        text, missing = transform_citation(citation, options)
+        write_transformed(directory, name, outfile, citation.PMID, text,
+                          missing, options)
+
+
+def write_transformed(directory, name, outfile, PMID, text, missing, options):
+    global missing_ascii_count
+
+    if missing:
+        missing_ascii_count += 1
+    if text is not None:
+        run_stage(options, 'write', write_text, directory, name, outfile,
+                  PMID, text, options)
+
+
+def write_text(directory, name, outfile, PMID, text, options):
+    suffix = '.txt' if not options.json else '.json'
+    if options.database is not None:
+        # keys as created by makedb.py without --keep-path
+        outfile[PMID+suffix] = text
+    elif directory is None:
         print(text, file=sys.stdout)
+    elif options.tgz:
+        fn = os.path.join(os.path.basename(name).split('.')[0], PMID+suffix)
+        save_in_tar(outfile, fn, text)
+    elif options.shard_depth:
+        from filewriter import file_path
+        relpath = file_path(PMID, suffix, options.shard_depth)
+        outfile.write(os.path.join(directory, relpath), text, PMID, name,
+                      relpath)
     else:
-        suffix = '.txt' if not options.json else '.json'
-        fn = os.path.join(directory, citation.PMID+suffix)
-        if options.tgz:
-            fn = os.path.join(os.path.basename(name).split('.')[0],
-                              os.path.basename(fn))
-            save_in_tar(outfile, fn, text)
-        else:
-            with open(fn, 'w', encoding='utf-8') as out:
-                out.write(text)
+        with open(os.path.join(directory, PMID+suffix), 'w',
+                  encoding='utf-8') as out:
+            out.write(text)
 
 
 def strip_extensions(fn):
@@ -678,10 +905,10 @@ def make_output_directory(fn, options):
     # create a directory for this package; we don't want to have all
     # the files in a single directory.
     base = strip_extensions(os.path.basename(fn))
-    if not options.tgz:
+    if not (options.tgz or options.pub_year or options.shard_depth):
         directory = os.path.join(options.output_dir, base)
     else:
-        # tgz: create output_dir only, no subdirs
+        # tgz, pub-year and sharded: create output_dir only, no subdirs
         directory = options.output_dir
     directory = os.path.normpath(directory)
     if os.path.isdir(directory):
@@ -699,50 +926,507 @@ def tarname(outdir, name):
     return os.path.join(outdir, base + '.tar.gz')
 
 
-def process_stream(stream, name, outdir, options):
-    global output_count, skipped_count
+def pub_year_name(outdir, name):
+    base = strip_extensions(os.path.basename(name))
+    return os.path.join(outdir, base + '.tsv')
 
-    if options.tgz:
-        outfile = tarfile.open(tarname(outdir, name), 'w:gz') # TODO use `with`
-    else:
-        outfile = None
+
+def citation_elements(stream, options):
+    """Yield MedlineCitation elements from iterparse stream.
+
+    Citations skipped by options are counted and not yielded. Elements
+    are cleared when the next one is requested.
+    """
+    global skipped_count
+
+    if options.profiler is not None:
+        stream = options.profiler.iterate('parse', stream)
+    progress, memory = options.progress, options.memory
+    checkpoint, quarantine = options.checkpoint, options.quarantine
+    if checkpoint is not None:
+        resume_position, resume_PMID, _ = checkpoint.resume()
 
     for event, element in stream:
         if event != 'end' or element.tag != 'MedlineCitation':
             continue
 
-        if skip_citation(element, options):
+        if checkpoint is not None:
+            checkpoint.position += 1
+            checkpoint.PMID = element.findtext('PMID')
+            if checkpoint.position <= resume_position:
+                # processed before the checkpoint
+                if (checkpoint.position == resume_position and
+                    checkpoint.PMID != resume_PMID):
+                    raise ValueError('%s changed after checkpoint: PMID %s '
+                                     'at position %d, expected %s' % (
+                                         checkpoint.file, checkpoint.PMID,
+                                         resume_position, resume_PMID))
+                element.clear()
+                continue
+
+        if progress is not None:
+            progress.update()
+        if memory is not None:
+            memory.update(element)
+
+        if quarantine is not None:
+            quarantine.current(element)
+            try:
+                skip = run_stage(options, 'skip', skip_citation, element,
+                                 options)
+            except Exception:
+                quarantine.add(element)
+                element.clear()
+                continue
+        else:
+            skip = run_stage(options, 'skip', skip_citation, element, options)
+
+        if skip:
             skipped_count += 1
-            element.clear()    # Won't need this
-            continue
+        else:
+            yield element
+
+        element.clear()    # Won't need this
 
-        citation = Citation.from_xml(element)
 
+def read_citations(stream, options):
+    """Yield Citations from iterparse stream, counting skipped ones."""
+    global skipped_count, empty_count
+
+    quarantine = options.quarantine
+    for element in citation_elements(stream, options):
+        try:
+            citation = run_stage(options, 'from_xml', Citation.from_xml,
+                                 element)
+        except Exception:
+            if quarantine is None:
+                raise
+            quarantine.add(element)
+            continue
         if options.skip_empty and citation.is_empty():
             skipped_count += 1
-            element.clear()    # Won't need this
+            empty_count += 1
+        else:
+            yield citation
+
+
+class PipelineError(object):
+    """Exception raised in a pipeline stage, passed on to the next."""
+
+    def __init__(self, exception):
+        self.exception = exception
+
+
+_END = object()    # marks the end of items in a pipeline queue
+
+
+def put_items(items, queue_, stop):
+    """Put items on queue followed by _END until stop is set.
+
+    An exception raised by items is put on queue as PipelineError.
+    """
+    def put(item):
+        while not stop.is_set():
+            try:
+                queue_.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+    try:
+        for item in items:
+            if not put(item):
+                return
+    except BaseException as e:
+        put(PipelineError(e))
+    else:
+        put(_END)
+
+
+def get_items(queue_, stop):
+    """Yield items from queue until _END or stop, raising PipelineErrors."""
+    while not stop.is_set():
+        try:
+            item = queue_.get(timeout=0.1)
+        except queue.Empty:
             continue
+        if item is _END:
+            return
+        elif isinstance(item, PipelineError):
+            raise item.exception
+        yield item
+
+
+def start_stage(items, maxsize, stop):
+    """Start thread putting items on a new queue, return the queue."""
+    queue_ = queue.Queue(maxsize=maxsize)
+    thread = threading.Thread(target=put_items, args=(items, queue_, stop),
+                              daemon=True)
+    thread.start()
+    return queue_, thread
+
+
+def transform_batch(citations):
+    """Transform citations in a transform process."""
+    options = transform_batch.options
+    return [(c.PMID,) + transform_citation(c, options) for c in citations]
+transform_batch.options = None
+
+
+def init_transform_process(options):
+    if options.mesh_index is not None:
+        # don't use the connection inherited from the parent on fork
+        from meshindex import MeshIndex
+        options.mesh_index = MeshIndex(options.mesh_index.path)
+    transform_batch.options = options
+
 
-        write_citation(outdir, name, outfile, citation, options)
-        output_count += 1
+def transform_pool(options):
+    """Return process pool for transforms, None if not used."""
+    if not options.transform_processes or options.columnar is not None:
+        return None
+    if options.transform_pool is None:
+        from concurrent.futures import ProcessPoolExecutor
+        # profiling, progress and memory tracking stay in this process
+        worker_options = copy.copy(options)
+        worker_options.profiler = None
+        worker_options.progress = None
+        worker_options.memory = None
+        worker_options.transform_pool = None
+        options.transform_pool = ProcessPoolExecutor(
+            options.transform_processes, initializer=init_transform_process,
+            initargs=(worker_options,))
+    return options.transform_pool
+
+
+def batched(items, size=PIPELINE_BATCH):
+    """Yield lists of up to size items."""
+    batch = []
+    for item in items:
+        batch.append(item)
+        if len(batch) >= size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def transformed(batches, options, pool):
+    """Yield lists of (PMID, text, missing) for batches of citations.
+
+    With a process pool, yield futures of the lists instead.
+    """
+    for batch in batches:
+        if pool is None:
+            yield [(c.PMID,) + transform_citation(c, options) for c in batch]
+        else:
+            yield pool.submit(transform_batch, batch)
 
-        element.clear()
 
+def process_pipelined(citations, outdir, name, outfile, options):
+    """Transform and write citations with parsing, transforms and output
+    in separate threads connected by bounded queues.
+
+    Parsing runs in a thread consuming citations, transforms in another
+    thread (or a process pool with --transform-processes) and output in
+    the calling thread, in input order.
+    """
+    global output_count
+
+    # queues hold batches of citations
+    stop = threading.Event()
+    parsed, parse_thread = start_stage(
+        batched(citations), max(1, options.parse_queue // PIPELINE_BATCH),
+        stop)
+    if options.columnar is not None:
+        # no transforms, add parsed citations in this thread
+        threads, results = [parse_thread], get_items(parsed, stop)
+    else:
+        output, transform_thread = start_stage(
+            transformed(get_items(parsed, stop), options,
+                        transform_pool(options)),
+            max(1, options.output_queue // PIPELINE_BATCH), stop)
+        threads = [parse_thread, transform_thread]
+        results = get_items(output, stop)
+    try:
+        for result in results:
+            if options.columnar is not None:
+                for citation in result:
+                    run_stage(options, 'write', outfile.add, citation)
+                    output_count += 1
+                continue
+            if not isinstance(result, list):
+                result = result.result()    # future from process pool
+            for PMID, text, missing in result:
+                write_transformed(outdir, name, outfile, PMID, text, missing,
+                                  options)
+                output_count += 1
+    finally:
+        stop.set()    # stops stages on error
+        for thread in threads:
+            thread.join()
+
+
+def open_tar(path, keep=0):
+    """Open tar.gz archive for writing.
+
+    With keep > 0, the first keep members of an existing, possibly
+    truncated archive are copied into the new one, e.g. when resuming
+    from a checkpoint.
+    """
+    partial = path + '.partial'
+    if keep and not os.path.exists(partial):
+        # if interrupted while copying, the partial archive remains
+        os.rename(path, partial)
+    # gzip stream opened separately so that it can be flushed
+    tar = tarfile.open(fileobj=gzip.GzipFile(path, 'wb'), mode='w')
+    if keep:
+        copied = copy_tar_members(partial, tar, keep)
+        if copied < keep:
+            raise ValueError('%s: expected %d members, found %d' % (
+                partial, keep, copied))
+        os.remove(partial)
+    return tar
+
+
+def copy_tar_members(path, tar, count):
+    """Copy up to count members of tar.gz archive in path into tar.
+
+    Return the number of members copied. Reading stops without error at
+    the end of a truncated archive.
+    """
+    copied = 0
+    with tarfile.open(path, 'r|gz') as source:
+        try:
+            for member in source:
+                source.members = []    # don't keep all TarInfos
+                if copied >= count:
+                    break
+                tar.addfile(member, source.extractfile(member))
+                copied += 1
+        except (tarfile.ReadError, EOFError, zlib.error):
+            pass    # truncated
+    return copied
+
+
+def close_tar(tar):
+    fileobj = tar.fileobj
+    tar.close()
+    fileobj.close()
+
+
+def open_text(path, offset=None):
+    """Open text file for writing, keeping offset bytes if not None."""
+    if offset is None:
+        return open(path, 'w', encoding='utf-8')
+    os.truncate(path, offset)
+    return open(path, 'a', encoding='utf-8')
+
+
+def run_counts(options):
+    """Return totals of the run so far for checkpoints."""
+    counts = dict(citation_counts())
+    counts['conditions'] = dict(condition_counts)
+    if options.quarantine is not None:
+        counts['quarantined'] = dict(options.quarantine.errors)
+    unicode2ascii = sys.modules.get('unicode2ascii')
+    if unicode2ascii is not None:
+        counts['missing_mapping'] = dict(unicode2ascii.missing_mapping)
+    return counts
+
+
+def restore_counts(counts, options):
+    """Restore totals from run_counts()."""
+    global output_count, skipped_count, empty_count, missing_ascii_count
+
+    output_count = counts['output']
+    skipped_count = counts['skipped']
+    empty_count = counts['empty']
+    missing_ascii_count = counts['missing_ascii']
+    condition_counts.update(counts['conditions'])
+    if options.quarantine is not None:
+        options.quarantine.errors.update(counts.get('quarantined', {}))
+    if 'missing_mapping' in counts:
+        import unicode2ascii
+        unicode2ascii.missing_mapping.update(counts['missing_mapping'])
+
+
+def flush_output(options, sink):
+    """Flush output shared by all inputs, return its checkpoint state."""
+    outputs = {}
+    if options.database is not None:
+        sink.commit()
+    elif options.output_dir == '-':
+        sys.stdout.flush()
+    elif sink is not None:
+        offset = sink.flush()
+        if offset is not None:
+            outputs['manifest_offset'] = offset
+    return outputs
+
+
+def save_checkpoint(options, outfile, sink):
+    """Flush outputs and save checkpoint after the current citation."""
+    file_outputs = {}
     if options.tgz:
-        outfile.close()
+        # sync flush makes the members written so far readable
+        outfile.fileobj.flush()
+        os.fsync(outfile.fileobj.fileno())
+        file_outputs['tar_members'] = len(outfile.members)
+    elif options.pub_year and outfile is not sys.stdout:
+        outfile.flush()
+        os.fsync(outfile.fileno())
+        file_outputs['offset'] = outfile.tell()
+    options.checkpoint.save(run_counts(options), flush_output(options, sink),
+                            file_outputs)
+
+
+def process_stream(stream, name, outdir, options, sink=None):
+    global output_count, skipped_count
 
+    checkpoint = options.checkpoint
+    if checkpoint is not None:
+        resume_outputs = checkpoint.resume()[2]
+    else:
+        resume_outputs = {}
+    if options.tgz:
+        outfile = open_tar(tarname(outdir, name),
+                           resume_outputs.get('tar_members', 0))
+    elif options.pub_year and outdir is not None:
+        outfile = open_text(pub_year_name(outdir, name),
+                            resume_outputs.get('offset'))
+    elif options.pub_year:
+        outfile = sys.stdout
+    else:
+        outfile = sink
+    if options.columnar is not None:
+        outfile.begin_group(name)
 
-def process(fn, options):
-    if options.output_dir == '-':
-        outdir = None    # use STDOUT
+    quarantine = options.quarantine
+    try:
+        if options.pub_year:
+            for element in citation_elements(stream, options):
+                # only dates needed, skip building Citation
+                try:
+                    written = run_stage(options, 'write', write_pub_year,
+                                        element, outfile)
+                except Exception:
+                    if quarantine is None:
+                        raise
+                    quarantine.add(element)
+                    continue
+                if written:
+                    output_count += 1
+                else:
+                    skipped_count += 1
+                if checkpoint is not None and checkpoint.due():
+                    save_checkpoint(options, outfile, sink)
+        elif options.pipeline:
+            # checkpoints only at the end of the file, as output lags input
+            process_pipelined(read_citations(stream, options), outdir, name,
+                              outfile, options)
+        else:
+            for citation in read_citations(stream, options):
+                try:
+                    write_citation(outdir, name, outfile, citation, options)
+                except Exception:
+                    if quarantine is None:
+                        raise
+                    quarantine.add()    # current citation element
+                    continue
+                output_count += 1
+                if checkpoint is not None and checkpoint.due():
+                    save_checkpoint(options, outfile, sink)
+    finally:
+        if options.tgz:
+            close_tar(outfile)
+        elif options.pub_year and outdir is not None:
+            outfile.close()
+    if options.columnar is not None:
+        outfile.end_group()
+
+
+def process(fn, options, sink=None):
+    if options.checkpoint is not None:
+        if options.checkpoint.is_completed(fn):
+            info('skipping %s (completed before checkpoint)' % fn)
+            return
+        options.checkpoint.start_file(fn)
+
+    if (options.output_dir == '-' or options.database is not None or
+        options.columnar is not None):
+        outdir = None    # use STDOUT, database or columnar output
     else:
         outdir = make_output_directory(fn, options)
 
-    if not fn.endswith('.gz'):
-        process_stream(ET.iterparse(fn), fn, outdir, options)
+    count = output_count + skipped_count
+    if options.quarantine is not None:
+        options.quarantine.start_file(fn)
+    if options.profiler is not None:
+        options.profiler.start_file(fn)
+    if options.memory is not None:
+        options.memory.start_file(fn)
+    with open_input(fn, options) as stream:
+        process_stream(ET.iterparse(stream), fn, outdir, options, sink)
+    if options.profiler is not None:
+        options.profiler.end_file(output_count + skipped_count - count)
+    if options.progress is not None:
+        options.progress.end_file()
+    if options.memory is not None:
+        options.memory.end_file()
+    if options.checkpoint is not None:
+        options.checkpoint.complete_file(run_counts(options),
+                                         flush_output(options, sink))
+
+
+@contextmanager
+def open_input(fn, options):
+    """Open fn for parsing, decompressing if it ends with .gz.
+
+    When profiling, reads are timed as the read or decompress stage.
+    """
+    with open(fn, 'rb') as raw:
+        if options.progress is not None:
+            options.progress.start_file(fn, raw)
+        if not fn.endswith('.gz'):
+            stream, stage = raw, 'read'
+        else:
+            stream, stage = gzip.GzipFile(fileobj=raw), 'decompress'
+        if options.profiler is not None:
+            from profiler import TimedReader
+            stream = TimedReader(stream, options.profiler, stage)
+        yield stream
+
+
+def open_output(options):
+    """Return writer shared by all inputs, None if not needed.
+
+    This is the database or columnar writer for --database and
+    --columnar and the threaded file writer for sharded output.
+    """
+    if options.columnar is not None:
+        import columnar
+        return columnar.open_writer(options.columnar,
+                                    options.columnar_format)
+    elif options.database is not None:
+        from citationdb import ThreadedWriter
+        return ThreadedWriter(options.database)
+    elif options.tgz or options.pub_year or options.output_dir == '-':
+        return None
+    elif options.shard_depth:
+        import filewriter
+        os.makedirs(options.output_dir, exist_ok=True)
+        filewriter.write_layout(options.output_dir, options.shard_depth,
+                                '.txt' if not options.json else '.json')
+        manifest = os.path.join(options.output_dir, filewriter.MANIFEST)
+        if options.resume and os.path.exists(manifest):
+            # drop entries written after the checkpoint
+            os.truncate(manifest,
+                        options.checkpoint.outputs.get('manifest_offset', 0))
+        return filewriter.FileWriter(options.write_threads, manifest=manifest)
     else:
-        with gzip.GzipFile(fn) as stream:
-            process_stream(ET.iterparse(stream), fn, outdir, options)
+        return None
 
 
 def read_ids(fn):
@@ -760,17 +1444,121 @@ def read_ids(fn):
     return ids
 
 
+def verify_md5(files):
+    """Check files against md5 sums in FILE.md5, return True if all match."""
+    import checkmd5
+    checks = []
+    for fn in files:
+        if os.path.exists(fn + '.md5'):
+            checks.append((fn, fn + '.md5'))
+        else:
+            warning('no %s.md5, not verifying %s' % (fn, fn))
+    cache = checkmd5.VerificationCache(checkmd5.DEFAULT_CACHE)
+    mismatches = checkmd5.verify(checks, cache)
+    for fn, actual, expected in mismatches:
+        error('md5 mismatch for %s: %s vs %s' % (fn, actual, expected))
+    return not mismatches
+
+
+def citation_counts():
+    counts = OrderedDict([('output', output_count),
+                          ('skipped', skipped_count)])
+    counts['empty'] = empty_count    # included in skipped
+    counts['missing_ascii'] = missing_ascii_count
+    return counts
+
+
 def process_options(argv):
-    options = argparser().parse_args(argv[1:])
+    return setup_options(argparser().parse_args(argv[1:]))
+
+
+def setup_options(options):
+    """Check parsed options and set up objects they select.
+
+    Return options, or None if invalid.
+    """
     if options.verbose:
         logging.getLogger().setLevel(logging.INFO)
     if options.mesh_trees:
         options.mesh_headings = True     # -mt implies -mh
+    if options.json_compact:
+        options.json = True    # -jc implies -j
+    if options.profile_json is not None:
+        options.profile = True    # -pj implies -pf
+    if options.transform_processes:
+        options.pipeline = True    # -tp implies -pp
+    options.transform_pool = None    # created on first use
+    if options.profile:
+        from profiler import Profiler
+        options.profiler = Profiler()
+    else:
+        options.profiler = None
+    if options.progress or options.progress_metrics is not None:
+        from progress import Progress
+        options.progress = Progress(
+            options.files, citation_counts, options.progress_interval,
+            sys.stderr if options.progress else None,
+            options.progress_metrics)
+    else:
+        options.progress = None
+    if options.memory_sites or options.memory_limit is not None:
+        options.memory = True    # -ms and -ml imply -mm
+    if options.memory:
+        from memtrack import MemoryTracker
+        limit = options.memory_limit
+        options.memory = MemoryTracker(
+            (Citation, ET.Element), options.memory_sites,
+            limit * 2**20 if limit is not None else None)
+    else:
+        options.memory = None
+    if options.expand_substances:
+        options.substances = True    # -xs implies -s
+        if options.mesh_index is None:
+            error('-xs requires a MeSH index (-mi)')
+            return None
+    if sum(1 for o in (options.database is not None, options.tgz,
+                       options.pub_year, options.columnar is not None)
+           if o) > 1:
+        error('at most one of -db, -z, -py and -cx allowed')
+        return None
+    if options.write_threads < 1:
+        error('-wt must be at least 1')
+        return None
+    if options.quarantine is not None and options.write_threads > 1:
+        # errors from threaded writes surface on a later citation
+        options.write_threads = 1
+    if options.quarantine is not None:
+        from quarantine import Quarantine
+        options.quarantine = Quarantine(options.quarantine)
+    if options.resume and options.checkpoint is None:
+        error('--resume requires a checkpoint file (-ck)')
+        return None
+    if options.checkpoint is not None:
+        if options.columnar is not None:
+            error('checkpoints not supported with -cx')
+            return None
+        from checkpoint import Checkpoint
+        if options.resume and os.path.exists(options.checkpoint):
+            options.checkpoint = Checkpoint.load(options.checkpoint,
+                                                 options.checkpoint_interval)
+        elif options.resume:
+            warning('no checkpoint %s, starting from the beginning' %
+                    options.checkpoint)
+            options.checkpoint = Checkpoint(options.checkpoint,
+                                            options.checkpoint_interval)
+        elif os.path.exists(options.checkpoint):
+            error('%s exists, use --resume to continue the run' %
+                  options.checkpoint)
+            return None
+        else:
+            options.checkpoint = Checkpoint(options.checkpoint,
+                                            options.checkpoint_interval)
     if options.tokenize and not options.ssplit:
         # Tokenizer assumes sentence-split input
         warning('--ssplit recommended with --tokenize')
     if (options.no_title and options.no_abstract and
-        not (options.mesh_headings or options.include_id or options.metadata)):
+        not (options.mesh_headings or options.include_id or options.metadata or
+             options.substances)):
         error('nothing to output (-nt and -na without other output options)')
         return None
     if options.PMID_greater_than is not None:
@@ -779,6 +1567,29 @@ def process_options(argv):
         options.PMID_lower_than = int(options.PMID_lower_than)
     if options.ids is not None:
         options.ids = read_ids(options.ids)
+    if options.mesh_index is not None:
+        from meshindex import MeshIndex
+        options.mesh_index = MeshIndex(options.mesh_index)
+        if (options.expand_substances and
+            'supplemental' not in options.mesh_index.kinds):
+            error('-xs requires supplementary concept records in MeSH '
+                  'index %s (extractMeSH.py -i with supp20XX.xml)' %
+                  options.mesh_index.path)
+            return None
+        if (options.mesh_under is not None and
+            'descriptor' not in options.mesh_index.kinds):
+            error('-mu requires descriptors in MeSH index %s '
+                  '(extractMeSH.py -i with desc20XX.xml)' %
+                  options.mesh_index.path)
+            return None
+    if options.mesh_under is not None:
+        options.mesh_under_ids = mesh_subtree_ids(options.mesh_under,
+                                                  options.mesh_index)
+        if not options.mesh_under_ids:
+            error('no MeSH descriptors under %s' % ' '.join(options.mesh_under))
+            return None
+        info('%d MeSH descriptors under %s' % (
+            len(options.mesh_under_ids), ' '.join(options.mesh_under)))
     return options
 
 
@@ -789,20 +1600,59 @@ def main(argv):
     if options is None:
         return 1
 
+    if options.verify_md5 and not verify_md5(options.files):
+        return 1
+
+    if options.checkpoint is not None and options.checkpoint.counts:
+        restore_counts(options.checkpoint.counts, options)
+
+    sink = open_output(options)
+    failed = 0
     for fn in options.files:
         try:
-            process(fn, options)
+            process(fn, options, sink)
+        except Exception:
+            error('Failed to process %s' % fn)
+            if options.quarantine is None:
+                raise
+            # e.g. XML syntax error; continue with the next file
+            options.quarantine.add_file()
+            failed += 1
         except:
             error('Failed to process %s' % fn)
             raise
+    if sink is not None:
+        sink.close()
+    if options.transform_pool is not None:
+        options.transform_pool.shutdown()
+    if options.checkpoint is not None and not failed:
+        options.checkpoint.remove()    # run complete
+    if options.quarantine is not None:
+        options.quarantine.close()
+
+    write_condition_statistics(options, sys.stderr)
+
+    if options.quarantine is not None:
+        options.quarantine.write_summary(sys.stderr)
 
     if options.ascii:
         write_to_ascii_statistics(sys.stderr)
 
+    if options.progress is not None:
+        options.progress.report(final=True)
+
+    if options.memory is not None:
+        options.memory.write_summary()
+
+    if options.profiler is not None:
+        options.profiler.write_report(sys.stderr)
+        if options.profile_json is not None:
+            options.profiler.write_json(options.profile_json)
+
     print('Done. Output data for %d PMIDs, skipped %d.' % (
         output_count, skipped_count), file=sys.stderr)
 
-    return 0
+    return 1 if failed else 0
 
 
 if __name__ == '__main__':
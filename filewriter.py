@@ -0,0 +1,165 @@
+#!/usr/bin/env python
+
+# Threaded writing of many small files and sharded directory layout
+# for extractTIABs.py output.
+#
+# In the sharded layout, the file for a PMID is placed under
+# directories named by hex digits of the MD5 hash of the PMID, e.g.
+# with two levels 1001 -> b8/c3/1001.txt. The layout is described in
+# layout.json in the output directory, and manifest.tsv lists
+# PMID<TAB>PATH<TAB>SOURCE for each file written so that readers can
+# find files without listing directories. Later runs into the same
+# directory append to the manifest (see read_manifest()).
+
+import os
+import json
+import hashlib
+import threading
+
+from concurrent.futures import ThreadPoolExecutor
+
+
+LAYOUT = 'layout.json'
+
+MANIFEST = 'manifest.tsv'
+
+
+def shard_path(PMID, levels):
+    """Return shard directory path for PMID."""
+    digest = hashlib.md5(PMID.encode('ascii')).hexdigest()
+    return os.path.join(*[digest[2*i:2*i+2] for i in range(levels)])
+
+
+def file_path(PMID, suffix, levels):
+    """Return path of file for PMID relative to the output directory."""
+    return os.path.join(shard_path(PMID, levels), PMID + suffix)
+
+
+def read_layout(directory):
+    with open(os.path.join(directory, LAYOUT)) as f:
+        return json.load(f)
+
+
+def find_file(directory, PMID, layout=None):
+    """Return path of file for PMID in sharded output directory."""
+    if layout is None:
+        layout = read_layout(directory)
+    return os.path.join(directory, file_path(PMID, layout['suffix'],
+                                             layout['levels']))
+
+
+def read_manifest(directory):
+    """Yield (PMID, path, source) for files in sharded output directory.
+
+    Runs writing into an existing directory append to the manifest, so
+    a PMID can be listed several times; only its last entry is yielded,
+    as the file was last written by that run. The whole manifest is
+    read before the first entry is yielded.
+    """
+    entries = {}
+    with open(os.path.join(directory, MANIFEST), encoding='utf-8') as f:
+        for l in f:
+            PMID, path, source = l.rstrip('\n').split('\t')
+            entries[PMID] = (path, source)
+    for PMID, (path, source) in entries.items():
+        yield PMID, os.path.join(directory, path), source
+
+
+def write_layout(directory, levels, suffix):
+    """Write layout.json, or check that an existing one matches."""
+    layout = { 'layout': 'sharded', 'hash': 'md5', 'levels': levels,
+               'suffix': suffix }
+    path = os.path.join(directory, LAYOUT)
+    if os.path.exists(path):
+        existing = read_layout(directory)
+        if existing != layout:
+            raise ValueError('{} has layout {}, not {}'.format(
+                directory, existing, layout))
+    else:
+        with open(path, 'w') as out:
+            json.dump(layout, out, indent=2, sort_keys=True)
+
+
+class FileWriter(object):
+    """Writes text files on a thread pool with a bounded queue.
+
+    write() blocks when queue_size writes are pending. Errors from the
+    worker threads are raised from the next write(), flush() or
+    close(). With a single thread, files are written synchronously by
+    write(). Manifest entries are added once the file is written.
+    """
+
+    def __init__(self, threads=4, queue_size=1000, manifest=None):
+        if threads < 1:
+            raise ValueError('threads must be at least 1')
+        if threads > 1:
+            self.executor = ThreadPoolExecutor(max_workers=threads)
+        else:
+            self.executor = None
+        self.queue_size = queue_size
+        self.slots = threading.BoundedSemaphore(queue_size)
+        self.created = set()
+        self.lock = threading.Lock()
+        self.error = None
+        self.manifest = None
+        if manifest is not None:
+            self.manifest = open(manifest, 'a', encoding='utf-8')
+
+    def _makedirs(self, directory):
+        # avoid repeated makedirs() calls for the same directory
+        if directory in self.created:
+            return
+        os.makedirs(directory, exist_ok=True)
+        with self.lock:
+            self.created.add(directory)
+
+    def _write(self, path, text, entry):
+        self._makedirs(os.path.dirname(path))
+        with open(path, 'w', encoding='utf-8') as out:
+            out.write(text)
+        if self.manifest is not None:
+            with self.lock:
+                print(entry, file=self.manifest)
+
+    def _write_async(self, path, text, entry):
+        try:
+            self._write(path, text, entry)
+        except BaseException as e:
+            self.error = e
+        finally:
+            self.slots.release()
+
+    def write(self, path, text, PMID=None, source=None, relpath=None):
+        if self.error is not None:
+            raise self.error
+        entry = '{}\t{}\t{}'.format(PMID, relpath, source)
+        if self.executor is None:
+            self._write(path, text, entry)
+        else:
+            self.slots.acquire()
+            self.executor.submit(self._write_async, path, text, entry)
+
+    def flush(self):
+        """Wait for pending writes and flush the manifest.
+
+        Return the manifest size after flushing, None if no manifest.
+        """
+        for i in range(self.queue_size):
+            self.slots.acquire()
+        for i in range(self.queue_size):
+            self.slots.release()
+        if self.error is not None:
+            raise self.error
+        if self.manifest is None:
+            return None
+        self.manifest.flush()
+        os.fsync(self.manifest.fileno())
+        return self.manifest.tell()
+
+    def close(self):
+        if self.executor is not None:
+            self.executor.shutdown(wait=True)
+        if self.manifest is not None:
+            self.manifest.close()
+        if self.error is not None:
+            raise self.error
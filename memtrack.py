@@ -0,0 +1,160 @@
+#!/usr/bin/env python
+
+# Per-file memory accounting for extractTIABs.py.
+#
+# Reports peak RSS for each input file, optionally with the top
+# allocation sites from tracemalloc, and counts of live objects of
+# given types (e.g. Citation and Element). RSS is checked periodically
+# against a soft limit; when the limit is exceeded, a warning is
+# logged with the range of PMIDs processed since the last check.
+#
+# Per-file peak RSS relies on resetting the high-water mark through
+# /proc/self/clear_refs (Linux 4.0+); elsewhere the process peak from
+# getrusage() is reported.
+
+import sys
+import gc
+import resource
+
+from logging import warning
+
+from progress import CHECK_EVERY
+
+
+def read_status(field):
+    """Return value of field in /proc/self/status in bytes, None if n/a."""
+    try:
+        with open('/proc/self/status') as f:
+            for l in f:
+                if l.startswith(field + ':'):
+                    return int(l.split()[1]) * 1024
+    except (IOError, ValueError):
+        pass
+    return None
+
+
+def current_rss():
+    rss = read_status('VmRSS')
+    if rss is None:
+        # no /proc, fall back to peak
+        rss = peak_rss()
+    return rss
+
+
+def peak_rss():
+    peak = read_status('VmHWM')
+    if peak is None:
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        if sys.platform != 'darwin':
+            peak *= 1024    # kilobytes except on macOS
+    return peak
+
+
+def reset_peak_rss():
+    """Reset the RSS high-water mark, return True if supported."""
+    try:
+        with open('/proc/self/clear_refs', 'w') as f:
+            f.write('5')
+        return True
+    except (IOError, OSError):
+        return False
+
+
+def count_live(types):
+    """Return dict of number of live GC-tracked objects by type name."""
+    counts = { t.__name__: 0 for t in types }
+    types = tuple(types)
+    for o in gc.get_objects():
+        if isinstance(o, types):
+            counts[type(o).__name__] = counts.get(type(o).__name__, 0) + 1
+    return counts
+
+
+def mb(n):
+    return n / 2**20
+
+
+class MemoryTracker(object):
+    """Tracks memory use per input file.
+
+    types are the classes whose live instances are counted at the end
+    of each file. With sites > 0, tracemalloc is enabled and the top
+    allocation sites by size are reported; this slows processing
+    considerably. limit is the soft RSS limit in bytes, None for none.
+    """
+
+    def __init__(self, types=(), sites=0, limit=None, out=sys.stderr):
+        self.types = types
+        self.sites = sites
+        self.limit = limit
+        self.out = out
+        self.per_file_peak = reset_peak_rss()
+        self.peaks = {}
+        self.name = None
+        self.calls = 0
+        self.last_PMID = None
+        self.warned = False
+        if sites:
+            import tracemalloc
+            tracemalloc.start()
+
+    def start_file(self, name):
+        self.name = name
+        self.calls = 0
+        self.last_PMID = None
+        self.warned = False
+        reset_peak_rss()
+        if self.sites:
+            import tracemalloc
+            tracemalloc.reset_peak()
+
+    def update(self, element):
+        """Call once per citation element; checks the soft limit."""
+        self.calls += 1
+        if self.limit is None or self.calls % CHECK_EVERY:
+            return
+        PMID = element.findtext('PMID')
+        rss = current_rss()
+        if rss > self.limit and not self.warned:
+            live = count_live(self.types)
+            warning('%s: RSS %.1f MB exceeds limit %.1f MB in PMID range '
+                    '%s-%s, live %s' % (
+                        self.name, mb(rss), mb(self.limit),
+                        self.last_PMID or 'start', PMID,
+                        ', '.join('%s %d' % i for i in sorted(live.items()))))
+            self.write_sites()
+            self.warned = True    # once per file
+        self.last_PMID = PMID
+
+    def end_file(self):
+        peak = peak_rss()
+        self.peaks[self.name] = peak
+        live = count_live(self.types)
+        print('%s: peak RSS %.1f MB%s, live %s' % (
+            self.name, mb(peak), '' if self.per_file_peak else ' (process)',
+            ', '.join('%s %d' % i for i in sorted(live.items()))),
+              file=self.out)
+        self.write_sites()
+
+    def write_sites(self):
+        if not self.sites:
+            return
+        import tracemalloc
+        current, peak = tracemalloc.get_traced_memory()
+        print('  traced %.1f MB, peak %.1f MB; top allocation sites:' % (
+            mb(current), mb(peak)), file=self.out)
+        snapshot = tracemalloc.take_snapshot().filter_traces([
+            tracemalloc.Filter(False, tracemalloc.__file__),
+        ])
+        for stat in snapshot.statistics('lineno')[:self.sites]:
+            frame = stat.traceback[0]
+            print('  %10.1f KB %8d blocks  %s:%d' % (
+                stat.size / 1024, stat.count, frame.filename, frame.lineno),
+                  file=self.out)
+
+    def write_summary(self):
+        if not self.peaks:
+            return
+        name = max(self.peaks, key=lambda n: self.peaks[n])
+        print('Highest peak RSS %.1f MB for %s' % (mb(self.peaks[name]), name),
+              file=self.out)
@@ -0,0 +1,285 @@
+#!/usr/bin/env python
+
+# Indexed MeSH lookup backed by SQLite. The index is written by
+# extractMeSH.py --index and can be queried without loading all of
+# MeSH into memory.
+
+import sys
+import json
+import sqlite3
+
+from logging import info, warning, error
+
+
+# Tables and indices by record type: descriptors from desc20XX.xml and
+# supplementary concept records (SCRs) from supp20XX.xml.
+SCHEMA = {
+    'descriptor': [
+        'CREATE TABLE descriptor (ui TEXT, name TEXT, scope TEXT)',
+        'CREATE TABLE name (name TEXT COLLATE NOCASE, ui TEXT, '
+        'preferred INTEGER)',
+        'CREATE TABLE treenum (treenum TEXT, ui TEXT)',
+    ],
+    'supplemental': [
+        'CREATE TABLE supplemental (ui TEXT, name TEXT)',
+        'CREATE TABLE heading_mapped (ui TEXT, descriptor_ui TEXT)',
+    ],
+}
+
+# Created after the load, which is considerably faster than
+# maintaining the indices for each insert.
+INDICES = {
+    'descriptor': [
+        'CREATE UNIQUE INDEX descriptor_ui ON descriptor (ui)',
+        'CREATE INDEX name_name ON name (name)',
+        'CREATE INDEX treenum_treenum ON treenum (treenum)',
+        'CREATE INDEX treenum_ui ON treenum (ui)',
+    ],
+    'supplemental': [
+        'CREATE UNIQUE INDEX supplemental_ui ON supplemental (ui)',
+        'CREATE INDEX heading_mapped_ui ON heading_mapped (ui)',
+    ],
+}
+
+TABLES = {
+    'descriptor': ['descriptor', 'name', 'treenum'],
+    'supplemental': ['supplemental', 'heading_mapped'],
+}
+
+# Largest code point; sorts after any character that can follow a prefix.
+MAX_CHAR = '\U0010ffff'
+
+
+def argparser():
+    import argparse
+    ap=argparse.ArgumentParser(description="Query MeSH index")
+    ap.add_argument('-u', '--ui', default=False, action='store_true',
+                    help='Look up QUERY as descriptor UI (default)')
+    ap.add_argument('-n', '--name', default=False, action='store_true',
+                    help='Look up QUERY as descriptor or entry term name')
+    ap.add_argument('-p', '--prefix', default=False, action='store_true',
+                    help='Look up QUERY as name prefix')
+    ap.add_argument('-t', '--tree', default=False, action='store_true',
+                    help='Enumerate descriptors under tree number prefix QUERY')
+    ap.add_argument('-s', '--supplemental', default=False,
+                    action='store_true',
+                    help='Look up descriptors mapped to supplementary '
+                    'concept record UI QUERY')
+    ap.add_argument('-j', '--json', default=False, action='store_true',
+                    help='Output JSON (default TSV)')
+    ap.add_argument('index', metavar='INDEX', help='MeSH index database')
+    ap.add_argument('query', metavar='QUERY', nargs='+', help='Query string')
+    return ap
+
+
+def prefix_range(prefix):
+    """Return (low, high) bounds for strings starting with prefix."""
+    return prefix, prefix + MAX_CHAR
+
+
+class MeshIndexWriter(object):
+    """Writes MeSH records into an indexed SQLite database.
+
+    Tables for a record type are recreated when the first record of
+    that type is added, so descriptors and supplementary concept
+    records can be written into the same database in separate runs.
+    """
+
+    def __init__(self, path, batch_size=10000):
+        self.path = path
+        self.batch_size = batch_size
+        self.conn = sqlite3.connect(path)
+        self.conn.execute('PRAGMA journal_mode=OFF')
+        self.conn.execute('PRAGMA synchronous=OFF')
+        self.pending = {}
+        self.kinds = []
+
+    def _create(self, kind):
+        for table in TABLES[kind]:
+            self.conn.execute('DROP TABLE IF EXISTS %s' % table)
+            self.pending[table] = []
+        for statement in SCHEMA[kind]:
+            self.conn.execute(statement)
+        self.kinds.append(kind)
+
+    def _insert(self, table, row):
+        rows = self.pending[table]
+        rows.append(row)
+        if len(rows) >= self.batch_size:
+            self._flush(table)
+
+    def _flush(self, table):
+        rows = self.pending[table]
+        if rows:
+            placeholders = ', '.join('?' * len(rows[0]))
+            self.conn.executemany('INSERT INTO %s VALUES (%s)' % (
+                table, placeholders), rows)
+            del rows[:]
+
+    def add(self, descriptor):
+        if 'descriptor' not in self.kinds:
+            self._create('descriptor')
+        self._insert('descriptor', (descriptor.id, descriptor.name,
+                                    descriptor.scope))
+        self._insert('name', (descriptor.name, descriptor.id, 1))
+        for term in (descriptor.terms or []):
+            if term != descriptor.name:
+                self._insert('name', (term, descriptor.id, 0))
+        for treenum in descriptor.treenums:
+            self._insert('treenum', (treenum, descriptor.id))
+
+    def add_supplemental(self, record):
+        if 'supplemental' not in self.kinds:
+            self._create('supplemental')
+        self._insert('supplemental', (record.id, record.name))
+        for ui in record.descriptors:
+            self._insert('heading_mapped', (record.id, ui))
+
+    def close(self):
+        for table in self.pending:
+            self._flush(table)
+        info('building indices for %s' % self.path)
+        for kind in self.kinds:
+            for statement in INDICES[kind]:
+                self.conn.execute(statement)
+        self.conn.commit()
+        self.conn.execute('VACUUM')
+        self.conn.close()
+
+
+class MeshIndex(object):
+    """Read-only access to an indexed MeSH database."""
+
+    def __init__(self, path):
+        self.path = path
+        self.conn = sqlite3.connect('file:%s?mode=ro' % path, uri=True,
+                                    check_same_thread=False)
+        tables = set(r[0] for r in self.conn.execute(
+            "SELECT name FROM sqlite_master WHERE type = 'table'"))
+        # record types with all tables present, see MeshIndexWriter
+        self.kinds = [k for k in TABLES if tables.issuperset(TABLES[k])]
+
+    def __getstate__(self):
+        # pickled by path, e.g. for process pool workers
+        return { 'path': self.path }
+
+    def __setstate__(self, state):
+        self.__init__(state['path'])
+
+    def close(self):
+        self.conn.close()
+
+    def treenums(self, ui):
+        """Return tree numbers for descriptor UI."""
+        return [r[0] for r in self.conn.execute(
+            'SELECT treenum FROM treenum WHERE ui = ? ORDER BY treenum',
+            (ui,))]
+
+    def lookup(self, ui):
+        """Return descriptor with given UI as dict, None if not found."""
+        row = self.conn.execute(
+            'SELECT ui, name, scope FROM descriptor WHERE ui = ?',
+            (ui,)).fetchone()
+        if row is None:
+            return None
+        return {
+            '_id': row[0],
+            'name': row[1],
+            'scope': row[2],
+            'treenums': self.treenums(row[0]),
+        }
+
+    def name(self, ui):
+        """Return name of descriptor or supplementary record, None if none."""
+        table = 'supplemental' if ui.startswith('C') else 'descriptor'
+        row = self.conn.execute(
+            'SELECT name FROM %s WHERE ui = ?' % table, (ui,)).fetchone()
+        return row[0] if row is not None else None
+
+    def heading_mapped(self, ui):
+        """Return descriptor UIs that supplementary record UI is mapped to."""
+        return [r[0] for r in self.conn.execute(
+            'SELECT descriptor_ui FROM heading_mapped WHERE ui = ?', (ui,))]
+
+    def ids_by_name(self, name, prefix=False):
+        """Return UIs of descriptors with (entry term) name.
+
+        Matching is case-insensitive for ASCII letters.
+        """
+        if not prefix:
+            rows = self.conn.execute(
+                'SELECT DISTINCT ui FROM name WHERE name = ?', (name,))
+        else:
+            rows = self.conn.execute(
+                'SELECT DISTINCT ui FROM name WHERE name >= ? AND name < ?',
+                prefix_range(name))
+        return [r[0] for r in rows]
+
+    def tree_entries(self, prefix):
+        """Return (treenum, UI) pairs for tree numbers starting with prefix."""
+        return list(self.conn.execute(
+            'SELECT treenum, ui FROM treenum '
+            'WHERE treenum >= ? AND treenum < ? ORDER BY treenum',
+            prefix_range(prefix)))
+
+    def ids_under(self, prefix):
+        """Return set of descriptor UIs in the MeSH subtree at prefix."""
+        ids = set(ui for t, ui in self.tree_entries(prefix + '.'))
+        if len(prefix) == 1:
+            # top-level ID; see extractTIABs.mesh_ancestors()
+            ids.update(ui for t, ui in self.tree_entries(prefix))
+        else:
+            ids.update(ui for t, ui in self.tree_entries(prefix)
+                       if t == prefix)
+        return ids
+
+
+def write_descriptor(obj, options, out=None):
+    if out is None:
+        out = sys.stdout
+    if options.json:
+        print(json.dumps(obj, sort_keys=True), file=out)
+    else:
+        print('\t'.join([obj['_id'], obj['name'], ','.join(obj['treenums'])]),
+              file=out)
+
+
+def query(index, q, options):
+    if options.tree:
+        ids = sorted(index.ids_under(q))
+    elif options.supplemental:
+        ids = index.heading_mapped(q)
+    elif options.name or options.prefix:
+        ids = index.ids_by_name(q, prefix=options.prefix)
+    else:
+        ids = [q]
+    found = 0
+    for ui in ids:
+        obj = index.lookup(ui)
+        if obj is None:
+            continue
+        write_descriptor(obj, options)
+        found += 1
+    if not found:
+        warning('no match for "%s"' % q)
+    return found
+
+
+def main(argv):
+    args = argparser().parse_args(argv[1:])
+    if sum(1 for f in ('ui', 'name', 'prefix', 'tree', 'supplemental')
+           if getattr(args, f)) > 1:
+        error('at most one of -u, -n, -p, -t and -s arguments allowed.')
+        return 1
+
+    index = MeshIndex(args.index)
+    found = 0
+    for q in args.query:
+        found += query(index, q, args)
+    index.close()
+
+    return 0 if found else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv))
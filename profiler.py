@@ -0,0 +1,158 @@
+#!/usr/bin/env python
+
+# Per-stage wall and CPU time accounting for extractTIABs.py --profile.
+
+import sys
+import json
+
+from time import perf_counter, process_time
+from collections import OrderedDict
+
+
+# Stages in pipeline order, for reporting
+STAGES = [
+    'read', 'decompress', 'parse', 'skip', 'from_xml', 'expand',
+    'to_ascii', 'ssplit', 'tokenize', 'serialize', 'write',
+]
+
+
+class Counter(object):
+    """Accumulated wall time, CPU time and number of calls."""
+
+    __slots__ = ('wall', 'cpu', 'calls')
+
+    def __init__(self):
+        self.wall = 0.0
+        self.cpu = 0.0
+        self.calls = 0
+
+    def add(self, other):
+        self.wall += other.wall
+        self.cpu += other.cpu
+        self.calls += other.calls
+
+    def rate(self, citations):
+        """Return citations per second of wall time in this stage."""
+        return citations / self.wall if self.wall > 0 else None
+
+    def to_dict(self, citations):
+        return {
+            'wall': self.wall,
+            'cpu': self.cpu,
+            'calls': self.calls,
+            'citations_per_second': self.rate(citations),
+        }
+
+
+class Profiler(object):
+    """Accumulates time per pipeline stage, per input file and in total.
+
+    CPU time is process CPU time, so it includes time spent in other
+    threads (e.g. output writers) during the stage.
+    """
+
+    def __init__(self):
+        self.files = OrderedDict()
+        self.current = None
+        self.start_time = None
+
+    def start_file(self, name):
+        self.current = self.files[name] = {}
+        self.start_time = perf_counter(), process_time()
+
+    def end_file(self, citations):
+        """End current file, recording number of citations processed."""
+        wall, cpu = self.start_time
+        total = self.counter('total')
+        total.wall += perf_counter() - wall
+        total.cpu += process_time() - cpu
+        total.calls = citations
+        # reads are made from within the parser; report parse
+        # time exclusive of them
+        parse = self.current.get('parse')
+        for stage in ('read', 'decompress'):
+            if parse is not None and stage in self.current:
+                parse.wall -= self.current[stage].wall
+                parse.cpu -= self.current[stage].cpu
+        self.current = None
+
+    def counter(self, stage):
+        try:
+            return self.current[stage]
+        except KeyError:
+            c = self.current[stage] = Counter()
+            return c
+
+    def run(self, stage, func, *args):
+        """Call func(*args) and add its time to stage."""
+        wall, cpu = perf_counter(), process_time()
+        try:
+            return func(*args)
+        finally:
+            c = self.counter(stage)
+            c.wall += perf_counter() - wall
+            c.cpu += process_time() - cpu
+            c.calls += 1
+
+    def iterate(self, stage, iterable):
+        """Yield items from iterable, adding time to produce each to stage."""
+        iterator = iter(iterable)
+        while True:
+            try:
+                item = self.run(stage, next, iterator)
+            except StopIteration:
+                return
+            yield item
+
+    def totals(self):
+        totals = OrderedDict()
+        for counters in self.files.values():
+            for stage, c in counters.items():
+                if stage not in totals:
+                    totals[stage] = Counter()
+                totals[stage].add(c)
+        return totals
+
+    def to_dict(self):
+        def ordered(counters):
+            citations = counters['total'].calls
+            return OrderedDict((s, counters[s].to_dict(citations))
+                               for s in STAGES + ['total'] if s in counters)
+        return {
+            'total': ordered(self.totals()),
+            'files': OrderedDict((name, ordered(counters))
+                                 for name, counters in self.files.items()),
+        }
+
+    def write_report(self, out=sys.stderr):
+        totals = self.totals()
+        if 'total' not in totals:
+            return
+        citations = totals['total'].calls
+        print('%-12s %10s %10s %10s %12s' % ('stage', 'wall s', 'cpu s',
+                                             'calls', 'citations/s'),
+              file=out)
+        for stage in STAGES + ['total']:
+            if stage not in totals:
+                continue
+            c = totals[stage]
+            rate = c.rate(citations)
+            rate = '%12.0f' % rate if rate is not None else '%12s' % '-'
+            print('%-12s %10.2f %10.2f %10d %s' % (stage, c.wall, c.cpu,
+                                                   c.calls, rate), file=out)
+
+    def write_json(self, fn):
+        with open(fn, 'w') as out:
+            json.dump(self.to_dict(), out, indent=2)
+
+
+class TimedReader(object):
+    """File object wrapper adding the time taken by read() to a stage."""
+
+    def __init__(self, fileobj, profiler, stage):
+        self.fileobj = fileobj
+        self.profiler = profiler
+        self.stage = stage
+
+    def read(self, size=-1):
+        return self.profiler.run(self.stage, self.fileobj.read, size)
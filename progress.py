@@ -0,0 +1,191 @@
+#!/usr/bin/env python
+
+# Periodic progress reporting for extractTIABs.py.
+#
+# Reports citation throughput, input bytes consumed against the total
+# size of the inputs, an ETA and citation counters to stderr and/or a
+# metrics file. Metrics files are written atomically (write and
+# rename) either as JSON (.json suffix) or in the Prometheus text
+# exposition format for the node_exporter textfile collector.
+
+import os
+import sys
+import json
+
+from time import time, monotonic
+
+
+METRIC_PREFIX = 'pubmed_extract'
+
+# How many citations to process between checks of the clock here and
+# in the checkpoint.py and memtrack.py periodic checks
+CHECK_EVERY = 256
+
+
+def format_duration(seconds):
+    if seconds is None:
+        return '?'
+    seconds = int(seconds)
+    return '%d:%02d:%02d' % (seconds // 3600, seconds // 60 % 60, seconds % 60)
+
+
+def format_bytes(n):
+    for unit in ('B', 'KB', 'MB', 'GB'):
+        if n < 1024:
+            break
+        n /= 1024
+    else:
+        unit = 'TB'
+    return '%.1f%s' % (n, unit)
+
+
+class Progress(object):
+    """Tracks progress over input files and reports it periodically.
+
+    counts is a function returning a dict of citation counters by
+    name, e.g. {'output': 10, 'skipped': 2, 'empty': 1}. Citations
+    processed are the sum of the 'output' and 'skipped' counts, other
+    counters are informational.
+    """
+
+    def __init__(self, files, counts, interval=30, out=sys.stderr,
+                 metrics=None):
+        self.counts = counts
+        self.interval = interval
+        self.out = out
+        self.metrics = metrics
+        self.files_total = len(files)
+        self.bytes_total = sum(os.path.getsize(fn) for fn in files)
+        self.files_done = 0
+        self.bytes_done = 0    # size of completed files
+        self.current = None
+        self.name = None
+        self.start = monotonic()
+        self.last = (self.start, 0)    # (time, citations) at last report
+        self.next_report = self.start + interval
+        self.calls = 0
+
+    def start_file(self, name, fileobj):
+        """Start reading name; fileobj.tell() gives bytes consumed."""
+        self.name = name
+        self.current = fileobj
+
+    def end_file(self):
+        self.files_done += 1
+        self.bytes_done += os.path.getsize(self.name)
+        self.current = None
+
+    def bytes_read(self):
+        consumed = self.bytes_done
+        if self.current is not None:
+            try:
+                consumed += self.current.tell()
+            except (ValueError, OSError):
+                pass    # closed
+        return consumed
+
+    def update(self):
+        """Call once per citation; reports when interval has passed."""
+        self.calls += 1
+        if self.calls % CHECK_EVERY:
+            return
+        if monotonic() >= self.next_report:
+            self.report()
+
+    def status(self):
+        now = monotonic()
+        counts = self.counts()
+        citations = counts['output'] + counts['skipped']
+        elapsed = now - self.start
+        last_time, last_citations = self.last
+        consumed = self.bytes_read()
+        byte_rate = consumed / elapsed if elapsed > 0 else 0
+        if byte_rate > 0:
+            eta = (self.bytes_total - consumed) / byte_rate
+        else:
+            eta = None
+        self.last = (now, citations)
+        return {
+            'elapsed_seconds': elapsed,
+            'citations': counts,
+            'citations_per_second': (
+                citations / elapsed if elapsed > 0 else 0),
+            'recent_citations_per_second': (
+                (citations - last_citations) / (now - last_time)
+                if now > last_time else 0),
+            'input_bytes_read': consumed,
+            'input_bytes_total': self.bytes_total,
+            'files_done': self.files_done,
+            'files_total': self.files_total,
+            'current_file': self.name,
+            'eta_seconds': eta,
+            'timestamp': time(),
+        }
+
+    def report(self, final=False):
+        status = self.status()
+        self.next_report = monotonic() + self.interval
+        if self.out is not None:
+            self.write_status(status, final)
+        if self.metrics is not None:
+            write_metrics(self.metrics, status)
+
+    def write_status(self, status, final=False):
+        total = status['input_bytes_total']
+        read = status['input_bytes_read']
+        print('%s %s/%s (%.1f%%) files %d/%d, %.0f citations/s '
+              '(recent %.0f), %s, ETA %s' % (
+                  'Done:' if final else 'Progress:',
+                  format_bytes(read), format_bytes(total),
+                  100.0 * read / total if total else 100.0,
+                  status['files_done'], status['files_total'],
+                  status['citations_per_second'],
+                  status['recent_citations_per_second'],
+                  ' '.join('%s %d' % i for i in status['citations'].items()),
+                  format_duration(0 if final else status['eta_seconds'])),
+              file=self.out)
+        self.out.flush()
+
+
+def prometheus_text(status):
+    """Return status in the Prometheus text exposition format."""
+    lines = []
+    def metric(name, type_, help_, samples):
+        name = '%s_%s' % (METRIC_PREFIX, name)
+        lines.append('# HELP %s %s' % (name, help_))
+        lines.append('# TYPE %s %s' % (name, type_))
+        for labels, value in samples:
+            lines.append('%s%s %s' % (name, labels, repr(float(value))))
+    metric('citations_total', 'counter', 'Citations processed by outcome.',
+           [('{outcome="%s"}' % k, v) for k, v in status['citations'].items()])
+    metric('citations_per_second', 'gauge',
+           'Mean citation throughput since start.',
+           [('', status['citations_per_second'])])
+    metric('recent_citations_per_second', 'gauge',
+           'Citation throughput since the previous report.',
+           [('', status['recent_citations_per_second'])])
+    metric('input_bytes_read', 'gauge', 'Input bytes consumed.',
+           [('', status['input_bytes_read'])])
+    metric('input_bytes_total', 'gauge', 'Total size of inputs.',
+           [('', status['input_bytes_total'])])
+    metric('files_done', 'gauge', 'Input files completed.',
+           [('', status['files_done'])])
+    metric('files_total', 'gauge', 'Input files.',
+           [('', status['files_total'])])
+    if status['eta_seconds'] is not None:
+        metric('eta_seconds', 'gauge', 'Estimated time to completion.',
+               [('', status['eta_seconds'])])
+    metric('last_update_timestamp_seconds', 'gauge',
+           'Time of the last update.', [('', status['timestamp'])])
+    return '\n'.join(lines) + '\n'
+
+
+def write_metrics(fn, status):
+    """Write status into fn as JSON or Prometheus text by suffix."""
+    tmpfn = fn + '.tmp'
+    with open(tmpfn, 'w', encoding='utf-8') as out:
+        if fn.endswith('.json'):
+            json.dump(status, out, indent=2)
+        else:
+            out.write(prometheus_text(status))
+    os.replace(tmpfn, fn)
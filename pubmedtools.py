@@ -1,94 +1,289 @@
 # Intended to keep generally useful functions for dealing with PubMed XML data.
+#
+# The element lookups here are shared by extractTIABs.py and keep no
+# state. iter_citations() streams lightweight records from PubMed XML
+# files and keeps no state between calls either, so separate iterators
+# can be used in different threads (a single iterator should not be
+# shared).
 
-import sys
+import io
+import os
+import re
+import gzip
+
+from collections import namedtuple
+from logging import warning
 
 try:
     import xml.etree.ElementTree as ET
-except ImportError: 
-    import cElementTree as ET 
+except ImportError:
+    import cElementTree as ET
 
-# Helper function for grabbing a text representation of the PMID,
-# title and abstract of a given file. NOTE: this isn't really
-# written as a library function; it may fail on assert and/or
-# print stuff on stderr. Use at your own risk.
 
-def getPmidTitleAbstract(fn):
-    try:
-        tree = ET.parse(fn)
-    except IOError:
-        print >> sys.stderr, "ERROR: failed to open PubMed XML file %s" % fn
-        raise
-
-    root = tree.getroot()
-
-    # This largely follows code from the parsePubmed.py script in the
-    # full-PubMed event extraction project (data/PubMed2009).
-
-    citations = tree.findall(".//MedlineCitation")
-    assert len(citations) == 1, "ERROR: expected 1 MedlineCitation, got %d" % len(citations)
-    citation = citations[0]    
-
-    # the citation element should have exactly one PMID child
-    PMIDs = citation.findall("PMID")
-    assert len(PMIDs) == 1, "ERROR: expected 1 PMID, got %d" % len(PMIDs)
-    PMID = PMIDs[0]
-
-    # likewise, there should be exactly one Article child
-    articles = citation.findall("Article")
-    assert len(articles) == 1, "ERROR: %d articles for PMID %s" % (len(articles), PMID.text)
-    article = articles[0]
-
-    # further, Article should have a single ArticleTitle
-    articleTitles = article.findall("ArticleTitle")
-    assert len(articleTitles) == 1, "ERROR: %d titles for PMID %s" % (len(articleTitles, PMID.text))
-    articleTitle = articleTitles[0]
-
-    # also, Article typically (but not always) contains an Abstract
-    abstracts = article.findall("Abstract")
-    assert len(abstracts) in (0,1), "ERROR: %d abstracts for PMID %s" % (len(abstracts, PMID.text))
-    abstract = None
-    if abstracts != []:
-        abstract = abstracts[0]
-
-    # if there's no Abstract, try to look for <OtherAbstract> in
-    # the citation (not the article) element, which seems to be
-    # used in some cases
+# Record fields that iter_citations() can extract
+FIELDS = ('PMID', 'title', 'abstract', 'sections', 'mesh', 'chemicals',
+          'pub_year')
+
+DEFAULT_FIELDS = ('PMID', 'title', 'abstract')
+
+# Fields not requested are None
+Record = namedtuple('Record', FIELDS)
+
+Section = namedtuple('Section', 'label text')
+Descriptor = namedtuple('Descriptor', 'id name major')
+Qualifier = namedtuple('Qualifier', 'id name major')
+MeshTerm = namedtuple('MeshTerm', 'descriptor qualifiers')
+Substance = namedtuple('Substance', 'id name regnum')
+
+# First four-digit number in a date, e.g. "Spring 1997" or "1998 Dec-1999 Jan"
+YEAR_RE = re.compile(r'\b(\d{4})\b')
+
+GZIP_MAGIC = b'\x1f\x8b'
+
+
+class FormatError(Exception):
+    pass
+
+
+class MissingElement(FormatError, KeyError):
+    pass
+
+
+def find_only(element, match):
+    """Return the only matching child of the given element.
+
+    Raise MissingElement (a KeyError) if no match and FormatError if
+    multiple matches.
+    """
+    found = element.findall(match)
+    if not found:
+        raise MissingElement('Error: expected 1 %s, got %d' % (
+            match, len(found)))
+    elif len(found) > 1:
+        raise FormatError('Error: expected 1 %s, got %d' % (
+            match, len(found)))
+    else:
+        return found[0]
+
+
+def inner_text(element):
+    """Return the catenated text of element and all subelements."""
+    return ''.join(element.itertext())
+
+
+def date_year(date):
+    """Return first year in date text such as MedlineDate, None if none."""
+    m = YEAR_RE.search(date)
+    return m.group(1) if m else None
+
+
+def find_abstract(citation, PMID=None):
+    """Return the Abstract element for given Article, or None if none."""
+    # basic case: exactly one <Abstract> in <Article>.
+    article = find_only(citation, 'Article')
+    abstracts = article.findall('Abstract')
+    if len(abstracts) > 1:
+        raise FormatError('Error: %d abstracts for PMID %s' % (
+            len(abstracts), PMID))
+    abstract = None if not abstracts else abstracts[0]
+
+    # if there's no <Abstract>, look for <OtherAbstract> in English in
+    # the citation (*not* the article).
     if abstract is None:
-        otherAbstracts = citation.findall("OtherAbstract")
+        otherAbstracts = []
+        for o in citation.findall('OtherAbstract'):
+            lang = o.attrib.get('Language')
+            if lang == 'eng':
+                otherAbstracts.append(o)
+            else:
+                warning('Skipping <OtherAbstract Languag="{}">'.format(lang))
         # This happens a few times.
         if len(otherAbstracts) > 1:
-            print >> sys.stderr, "NOTE: %d 'other' abstracts for PMID %s. Only using first." % (len(otherAbstracts), PMID.text)
+            warning('%d "other" abstracts for PMID %s. Only using first.' %
+                    (len(otherAbstracts), PMID))
         if otherAbstracts != []:
             abstract = otherAbstracts[0]
 
-    abstractText = None
-    textAbstract = ""
-    if abstract is not None:
-        # if there's an Abstract, it should contain an AbstractText
-        abstractTexts = abstract.findall("AbstractText")
-        assert len(abstractTexts) != 0, "ERROR: %d abstract texts for PMID %s" % (len(abstractTexts), PMID.text)
-
-        if len(abstractTexts) == 1:
-            abstractText = abstractTexts[0]
-            textAbstract = abstractText.text
-        else:
-            # recent versions of PubMed data may contain multiple
-            # AbstractText elements for structured abstracts. In these
-            # cases, "label" attributes give structured abstract
-            # section headers and should be combined into the text.
-            assert len(abstractTexts) > 1, "INTERNAL ERROR"
-            sectionTexts = []
-            for at in abstractTexts:
-                t = ""
-                if "Label" in at.attrib:
-                    t = at.attrib["Label"] + ": "
-                else:
-                    print >> sys.stderr, "Warning: missing 'Label' for multiple <AbstractText>s"
-                t += at.text
-                sectionTexts.append(t)
-            textAbstract = " ".join(sectionTexts)
-                    
-    # OK, we've got all the elements we need. Grab the texts
-    textPMID     = PMID.text
-    textTitle    = articleTitle.text        
-    return (textPMID, textTitle, textAbstract)
+    return abstract
+
+
+def section_label(element):
+    """Return label of <AbstractText>, empty string if none."""
+    label = element.attrib.get('Label', '')
+    # The special Label "UNLABELLED" is interpreted as empty.
+    return label if label != 'UNLABELLED' else ''
+
+
+def mesh_term(element):
+    """Return MeshTerm for <MeshHeading> element."""
+    desc = find_only(element, 'DescriptorName')
+    descriptor = Descriptor(desc.attrib.get('UI'), desc.text,
+                            desc.attrib.get('MajorTopicYN') == 'Y')
+    qualifiers = tuple(
+        Qualifier(q.attrib.get('UI'), q.text,
+                  q.attrib.get('MajorTopicYN') == 'Y')
+        for q in element.iterfind('QualifierName'))
+    return MeshTerm(descriptor, qualifiers)
+
+
+def substance(element):
+    """Return Substance for <Chemical> element."""
+    name = find_only(element, 'NameOfSubstance')
+    return Substance(name.attrib.get('UI'), name.text,
+                     find_only(element, 'RegistryNumber').text)
+
+
+def abstract_sections(citation, PMID):
+    """Return tuple of non-empty Sections in the abstract of citation."""
+    abstract = find_abstract(citation, PMID)
+    if abstract is None:
+        return ()
+    sections = []
+    for a in abstract.iterfind('AbstractText'):
+        section = Section(section_label(a), inner_text(a))
+        if section.label or section.text.strip():
+            sections.append(section)
+    return tuple(sections)
+
+
+def abstract_text(sections):
+    """Return abstract text for sections.
+
+    As in getPmidTitleAbstract(), the text of a single section is
+    returned without its label, and multiple sections are joined with
+    spaces, prefixed by their labels as in "METHODS: ...".
+    """
+    if len(sections) == 1:
+        return sections[0].text
+    return ' '.join(s.label + ': ' + s.text if s.label else s.text
+                    for s in sections)
+
+
+def pub_year(citation, normalize=date_year):
+    """Return publication year of citation, None if not found.
+
+    Without <Year>, the year is found in <MedlineDate> text with
+    normalize, e.g. a caching version of date_year().
+    """
+    pubdate = find_only(find_only(citation, 'Article'), './/PubDate')
+    year = pubdate.findtext('Year')
+    if year is not None:
+        return year
+    date = pubdate.findtext('MedlineDate')
+    return normalize(date) if date is not None else None
+
+
+def make_record(citation, fields):
+    """Return Record with given fields for MedlineCitation element."""
+    values = dict.fromkeys(FIELDS)
+    values['PMID'] = PMID = find_only(citation, 'PMID').text
+    if 'title' in fields:
+        values['title'] = inner_text(
+            find_only(find_only(citation, 'Article'), 'ArticleTitle'))
+    if 'abstract' in fields or 'sections' in fields:
+        sections = abstract_sections(citation, PMID)
+        if 'sections' in fields:
+            values['sections'] = sections
+        if 'abstract' in fields:
+            values['abstract'] = abstract_text(sections)
+    if 'mesh' in fields:
+        values['mesh'] = tuple(
+            mesh_term(h)
+            for h in citation.iterfind('MeshHeadingList/MeshHeading'))
+    if 'chemicals' in fields:
+        values['chemicals'] = tuple(
+            substance(c) for c in citation.iterfind('ChemicalList/Chemical'))
+    if 'pub_year' in fields:
+        values['pub_year'] = pub_year(citation)
+    return Record(**values)
+
+
+def pmid_range(greater_than=None, lower_than=None):
+    """Return filter accepting PMIDs in the open interval given."""
+    def accept(record):
+        PMID = int(record.PMID)
+        return ((greater_than is None or PMID > greater_than) and
+                (lower_than is None or PMID < lower_than))
+    accept.fields = ('PMID',)
+    return accept
+
+
+def pmid_in(ids):
+    """Return filter accepting the given PMIDs."""
+    ids = frozenset(str(i) for i in ids)
+    def accept(record):
+        return record.PMID in ids
+    accept.fields = ('PMID',)
+    return accept
+
+
+def has_abstract(record):
+    """Filter accepting citations with a non-empty abstract."""
+    return bool(record.sections)
+has_abstract.fields = ('sections',)
+
+
+def citation_elements(source):
+    """Yield MedlineCitation elements from path or binary stream.
+
+    Gzipped input is recognized by content. Each element is cleared
+    when the next one is requested.
+    """
+    if isinstance(source, (str, bytes, os.PathLike)):
+        with open(source, 'rb') as stream:
+            yield from citation_elements(stream)
+        return
+
+    if isinstance(source, io.TextIOBase):
+        raise TypeError('binary stream required, got text stream')
+    if not hasattr(source, 'peek'):
+        source = io.BufferedReader(source)
+    if source.peek(len(GZIP_MAGIC))[:len(GZIP_MAGIC)] == GZIP_MAGIC:
+        source = gzip.GzipFile(fileobj=source)
+
+    root = None
+    for event, element in ET.iterparse(source, events=('start', 'end')):
+        if root is None:
+            root = element
+        if event == 'end' and element.tag == 'MedlineCitation':
+            yield element
+            element.clear()
+            if element is not root:
+                root.clear()    # drop references to processed citations
+
+
+def iter_citations(source, fields=DEFAULT_FIELDS, filters=()):
+    """Yield Records for citations in PubMed XML path or binary stream.
+
+    Gzipped input is recognized by content. Only the given fields are
+    extracted, the others are None. filters are functions taking a
+    Record and returning False for citations that should not be
+    yielded; fields a filter needs may be listed in its "fields"
+    attribute (see pmid_range(), pmid_in() and has_abstract()),
+    otherwise filters see only the requested fields. Raises FormatError
+    for malformed citations.
+    """
+    fields = frozenset(fields)
+    unknown = fields.difference(FIELDS)
+    if unknown:
+        raise ValueError('unknown fields: %s' % ', '.join(sorted(unknown)))
+    needed = fields.union(*(getattr(f, 'fields', ()) for f in filters))
+    extra = dict.fromkeys(needed - fields)
+    for element in citation_elements(source):
+        record = make_record(element, needed)
+        if all(f(record) for f in filters):
+            yield record._replace(**extra) if extra else record
+
+
+def getPmidTitleAbstract(fn):
+    """Return (PMID, title, abstract) for PubMed XML file with a single
+    citation. Raises FormatError if fn has more or fewer citations.
+
+    Kept for existing callers; use iter_citations() for new code.
+    """
+    records = list(iter_citations(fn))
+    if len(records) != 1:
+        raise FormatError('expected 1 MedlineCitation in %s, got %d' % (
+            fn, len(records)))
+    record = records[0]
+    return (record.PMID, record.title, record.abstract)
@@ -0,0 +1,89 @@
+#!/usr/bin/env python
+
+# Quarantine file for citations that fail processing in
+# extractTIABs.py --quarantine.
+#
+# Each failure is written as a JSON object on its own line with the
+# source file, PMID, error, traceback and the raw MedlineCitation XML
+# (null for failures affecting a whole input file).
+
+import sys
+import json
+import threading
+import traceback
+
+import xml.etree.ElementTree as ET
+
+from collections import Counter
+
+
+class Quarantine(object):
+    """Records citations that failed processing.
+
+    add() must be called from an exception handler. element is the
+    citation being processed by default; see current().
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.out = None    # opened on first failure
+        self.source = None
+        self.element = None
+        self.errors = Counter()
+        self.lock = threading.Lock()
+
+    def start_file(self, source):
+        self.source = source
+        self.element = None
+
+    def current(self, element):
+        """Set citation element being processed."""
+        self.element = element
+
+    def add(self, element=None):
+        """Record the exception being handled for citation element."""
+        self._record(element if element is not None else self.element)
+
+    def add_file(self):
+        """Record the exception being handled for the whole input file."""
+        self._record(None)
+
+    def _record(self, element):
+        exc_type, exc, tb = sys.exc_info()
+        record = {
+            'source': self.source,
+            'PMID': element.findtext('PMID') if element is not None else None,
+            'error': '%s: %s' % (exc_type.__name__, exc),
+            'traceback': ''.join(traceback.format_exception(exc_type, exc,
+                                                            tb)),
+            'xml': (ET.tostring(element, encoding='unicode')
+                    if element is not None else None),
+        }
+        with self.lock:
+            if self.out is None:
+                self.out = open(self.path, 'a', encoding='utf-8')
+            print(json.dumps(record, ensure_ascii=False), file=self.out)
+            self.out.flush()
+            self.errors[exc_type.__name__] += 1
+
+    def count(self):
+        return sum(self.errors.values())
+
+    def write_summary(self, out=sys.stderr):
+        if not self.errors:
+            return
+        print('Quarantined %d failures in %s: %s' % (
+            self.count(), self.path, ', '.join(
+                '%s %d' % i for i in self.errors.most_common())), file=out)
+
+    def close(self):
+        if self.out is not None:
+            self.out.close()
+            self.out = None
+
+
+def read_quarantine(path):
+    """Yield records from quarantine file."""
+    with open(path, encoding='utf-8') as f:
+        for l in f:
+            yield json.loads(l)
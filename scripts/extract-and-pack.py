@@ -0,0 +1,154 @@
+#!/usr/bin/env python3
+
+# Extract texts from PubMed XML and package them as tar.gz.
+#
+# In-process replacement for extract-and-pack.sh: citations are
+# streamed directly into the output archive instead of being written
+# to temporary files first, and several inputs are processed
+# concurrently. extractTIABs.py options are accepted, except for
+# those selecting the output and per-run reports and state files.
+
+import os
+import sys
+import copy
+import shutil
+import tempfile
+
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from logging import error
+
+# extractTIABs.py is found in the parent directory
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                os.pardir))
+
+import extractTIABs
+import unicode2ascii
+
+
+# extractTIABs.py options that conflict with the archives written here
+# or whose reports and files would be written separately by each
+# worker, by destination in the parsed options and its default value
+REJECTED_OPTIONS = [
+    ('-o', 'output_dir', 'texts'),
+    ('-z', 'tgz', False),
+    ('-db', 'database', None),
+    ('-py', 'pub_year', False),
+    ('-cx', 'columnar', None),
+    ('-ck', 'checkpoint', None),
+    ('-qf', 'quarantine', None),
+    ('-pf', 'profile', False),
+    ('-pj', 'profile_json', None),
+    ('-pr', 'progress', False),
+    ('-pm', 'progress_metrics', None),
+    ('-mm', 'memory', False),
+    ('-ms', 'memory_sites', 0),
+    ('-ml', 'memory_limit', None),
+]
+
+def argparser():
+    # extractTIABs.py options with the ones for this script added
+    ap = extractTIABs.argparser()
+    ap.description = ('Extract texts from PubMed XML and package them as '
+                      'tar.gz.')
+    ap.add_argument('-P', '--processes', default=os.cpu_count(), type=int,
+                    help='number of inputs to process in parallel')
+    ap.add_argument('-d', '--directory', default='.',
+                    help='directory for output archives (default ".")')
+    return ap
+
+
+def archive_name(directory, fn):
+    """Return output archive path for input fn as in extract-and-pack.sh."""
+    return extractTIABs.tarname(directory, fn)
+
+
+def extract(fn, directory, args):
+    """Extract citations from fn into archive in directory.
+
+    Return the number of citations output and skipped with Counters of
+    the data conditions noted and characters without ASCII mapping.
+    """
+    target = archive_name(directory, fn)
+    # Write into a temporary directory next to the target and move the
+    # finished archive into place so that failures leave no partial
+    # archives behind.
+    tmpdir = tempfile.mkdtemp(prefix='extract-', dir=directory)
+    try:
+        options = copy.copy(args)
+        options.tgz, options.output_dir, options.files = True, tmpdir, [fn]
+        options = extractTIABs.setup_options(options)
+        if options is None:
+            raise ValueError('invalid extractTIABs.py options')
+        # worker processes may be reused, so totals are differences
+        output, skipped = (extractTIABs.output_count,
+                           extractTIABs.skipped_count)
+        conditions = Counter(extractTIABs.condition_counts)
+        missing = Counter(unicode2ascii.missing_mapping)
+        try:
+            extractTIABs.process(fn, options)
+        finally:
+            if options.transform_pool is not None:
+                options.transform_pool.shutdown()
+        if os.path.exists(target):
+            raise FileExistsError("{} exists already, won't clobber.".format(
+                target))
+        os.rename(archive_name(tmpdir, fn), target)
+    finally:
+        shutil.rmtree(tmpdir)
+    return (extractTIABs.output_count - output,
+            extractTIABs.skipped_count - skipped,
+            Counter(extractTIABs.condition_counts) - conditions,
+            Counter(unicode2ascii.missing_mapping) - missing)
+
+
+def main(argv):
+    ap = argparser()
+    args = ap.parse_args(argv[1:])
+    for option, dest, default in REJECTED_OPTIONS:
+        if getattr(args, dest) != default:
+            ap.error('option {} not supported'.format(option))
+
+    if args.verify_md5 and not extractTIABs.verify_md5(args.files):
+        return 1
+
+    for fn in args.files:
+        target = archive_name(args.directory, fn)
+        if os.path.exists(target):
+            error("{} exists already, won't clobber.".format(target))
+            return 1
+
+    output_total, skipped_total, failed = 0, 0, 0
+    with ProcessPoolExecutor(max_workers=args.processes) as executor:
+        futures = {}
+        for fn in args.files:
+            future = executor.submit(extract, fn, args.directory, args)
+            futures[future] = fn
+        for future in as_completed(futures):
+            fn = futures[future]
+            try:
+                output, skipped, conditions, missing = future.result()
+            except Exception as e:
+                error('Failed to process {}: {}'.format(fn, e))
+                failed += 1
+                continue
+            output_total += output
+            skipped_total += skipped
+            extractTIABs.condition_counts.update(conditions)
+            for c, count in missing.items():
+                unicode2ascii.missing_mapping[c] = (
+                    unicode2ascii.missing_mapping.get(c, 0) + count)
+            print('Packed {} to {}.'.format(
+                fn, archive_name(args.directory, fn)), file=sys.stderr)
+
+    extractTIABs.write_condition_statistics(args, sys.stderr)
+    if args.ascii:
+        extractTIABs.write_to_ascii_statistics(sys.stderr)
+
+    print('Done. Output data for {} PMIDs, skipped {}.'.format(
+        output_total, skipped_total), file=sys.stderr)
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv))
@@ -5,19 +5,22 @@
 
 import sys
 import os
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), os.pardir))
+
 from pubmedtools import getPmidTitleAbstract
 
 if len(sys.argv) != 2:
-    print >> sys.stderr, "Usage:", sys.argv[0], "FILE"
+    print("Usage:", sys.argv[0], "FILE", file=sys.stderr)
     sys.exit(1)
 pmxmlfn = sys.argv[1]
 
 (PMID, title, abstract) = getPmidTitleAbstract(pmxmlfn)
 
-sys.stdout.write(title.encode("utf-8")+"\n")
+print(title)
 
 if abstract == "":
-    print >> sys.stderr, "Warning:", sys.argv[0], "title only for PMID %s" % PMID
+    print("Warning:", sys.argv[0], "title only for PMID %s" % PMID,
+          file=sys.stderr)
 else:
-    sys.stdout.write(abstract.encode("utf-8")+"\n")
-
+    print(abstract)
@@ -0,0 +1,203 @@
+#!/usr/bin/env python3
+
+# Local read-only HTTP lookup service over a makedb.py database.
+#
+# GET  /get?pmid=1,2,3
+# POST /get  {"pmids": ["1", "2", "3"]}
+#
+# both return a JSON object mapping each requested PMID to its stored
+# text (null if not found). GET /health returns {"status": "ok"}.
+
+import os
+import sys
+import json
+import socketserver
+import threading
+
+from collections import OrderedDict
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qs
+from logging import info
+
+# citationdb.py is found in the parent directory
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                os.pardir))
+
+from citationdb import Reader
+
+
+def argparser():
+    from argparse import ArgumentParser
+    ap = ArgumentParser(description='Serve makedb.py database lookups')
+    ap.add_argument('-p', '--port', default=8088, type=int,
+                    help='port on localhost (default 8088)')
+    ap.add_argument('-u', '--unix-socket', metavar='PATH', default=None,
+                    help='listen on Unix socket PATH instead of port')
+    ap.add_argument('-s', '--suffix', default='.txt',
+                    help='suffix of database keys (default ".txt")')
+    ap.add_argument('-c', '--connections', default=4, type=int,
+                    help='number of pooled read connections (default 4)')
+    ap.add_argument('-C', '--cache-size', default=100000, type=int,
+                    help='number of records to cache (default 100000)')
+    ap.add_argument('-m', '--max-batch', default=10000, type=int,
+                    help='maximum number of PMIDs per request')
+    ap.add_argument('-v', '--verbose', default=False, action='store_true',
+                    help='log requests')
+    ap.add_argument('db', help='database name')
+    return ap
+
+
+class LRUCache(object):
+    """Thread-safe least recently used cache."""
+
+    def __init__(self, size):
+        self.size = size
+        self.data = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, key, default=None):
+        with self.lock:
+            try:
+                self.data.move_to_end(key)
+            except KeyError:
+                return default
+            return self.data[key]
+
+    def put(self, key, value):
+        if self.size <= 0:
+            return
+        with self.lock:
+            self.data[key] = value
+            self.data.move_to_end(key)
+            while len(self.data) > self.size:
+                self.data.popitem(last=False)
+
+
+class Lookup(object):
+    """Batch lookup by PMID with an LRU cache in front of the database."""
+
+    def __init__(self, db, options):
+        self.db = db
+        self.suffix = options.suffix
+        self.cache = LRUCache(options.cache_size)
+
+    def get(self, pmids):
+        results, missing = {}, []
+        for pmid in pmids:
+            value = self.cache.get(pmid, self)
+            if value is self:
+                missing.append(pmid)
+            else:
+                results[pmid] = value
+        if missing:
+            found = self.db.get_many(pmid + self.suffix for pmid in missing)
+            for pmid in missing:
+                value = found.get(pmid + self.suffix)
+                if value is not None:
+                    self.cache.put(pmid, value)
+                results[pmid] = value
+        return results
+
+
+class LookupHandler(BaseHTTPRequestHandler):
+
+    protocol_version = 'HTTP/1.1'    # keep-alive
+
+    def address_string(self):
+        # client_address is empty for Unix sockets
+        return self.client_address[0] if self.client_address else 'unix'
+
+    def log_message(self, format, *args):
+        if self.server.options.verbose:
+            info('%s %s' % (self.address_string(), format % args))
+
+    def send_json(self, code, obj):
+        data = json.dumps(obj).encode('utf-8')
+        self.send_response(code)
+        self.send_header('Content-Type', 'application/json; charset=utf-8')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def lookup(self, pmids):
+        pmids = [str(p).strip() for p in pmids if str(p).strip()]
+        if len(pmids) > self.server.options.max_batch:
+            self.send_json(413, {'error': 'at most %d PMIDs per request' %
+                                 self.server.options.max_batch})
+        else:
+            self.send_json(200, self.server.lookup.get(pmids))
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        if url.path == '/health':
+            self.send_json(200, {'status': 'ok'})
+        elif url.path == '/get':
+            query = parse_qs(url.query)
+            pmids = [p for v in query.get('pmid', []) for p in v.split(',')]
+            self.lookup(pmids)
+        else:
+            self.send_json(404, {'error': 'not found'})
+
+    def do_POST(self):
+        url = urlparse(self.path)
+        if url.path != '/get':
+            self.send_json(404, {'error': 'not found'})
+            return
+        length = int(self.headers.get('Content-Length', 0))
+        try:
+            pmids = json.loads(self.rfile.read(length))['pmids']
+        except (ValueError, KeyError, TypeError):
+            self.send_json(400, {'error': 'expected {"pmids": [...]}'})
+            return
+        self.lookup(pmids)
+
+
+class TCPLookupHandler(LookupHandler):
+
+    disable_nagle_algorithm = True    # TCP only; avoids delayed ACK stalls
+
+
+class UnixHTTPServer(socketserver.ThreadingMixIn,
+                     socketserver.UnixStreamServer):
+    daemon_threads = True
+
+    def server_bind(self):
+        if os.path.exists(self.server_address):
+            os.unlink(self.server_address)
+        socketserver.UnixStreamServer.server_bind(self)
+
+
+def make_server(options, lookup):
+    if options.unix_socket is not None:
+        server = UnixHTTPServer(options.unix_socket, LookupHandler)
+        address = options.unix_socket
+    else:
+        server = ThreadingHTTPServer(('127.0.0.1', options.port),
+                                     TCPLookupHandler)
+        address = 'http://127.0.0.1:%d' % options.port
+    server.options = options
+    server.lookup = lookup
+    return server, address
+
+
+def main(argv):
+    args = argparser().parse_args(argv[1:])
+    if args.verbose:
+        import logging
+        logging.getLogger().setLevel(logging.INFO)
+    with Reader(args.db, pool_size=args.connections) as db:
+        server, address = make_server(args, Lookup(db, args))
+        print('Serving {} on {}'.format(args.db, address), file=sys.stderr)
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            server.server_close()
+            if args.unix_socket is not None:
+                os.unlink(args.unix_socket)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv))
@@ -4,22 +4,56 @@ import os
 import sys
 import tarfile
 
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
 from logging import warning, error
 
-try:
-    import sqlitedict
-except ImportError:
-    error('failed to import sqlitedict; try `pip3 install sqlitedict`')
-    raise
+# citationdb.py is found in the parent directory
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                os.pardir))
+
+from citationdb import BulkLoader, codecs, default_codec
+from citationdb import build_fts, FTS_TOKENIZERS
+
+
+def open_sqlitedict(dbname):
+    try:
+        import sqlitedict
+    except ImportError:
+        error('failed to import sqlitedict; try `pip3 install sqlitedict`')
+        raise
+    return sqlitedict.SqliteDict(dbname, autocommit=True)
 
 
 def argparser():
     from argparse import ArgumentParser
     ap = ArgumentParser()
     ap.add_argument('-s', '--suffix', default=None,
-                    help='suffix of files to insert (default any)')
+                    help='suffix of files to insert, e.g. ".txt" (default any)')
     ap.add_argument('-p', '--keep-path', default=False, action='store_true',
                     help='keep paths as part of db keys')
+    ap.add_argument('-b', '--bulk', default=False, action='store_true',
+                    help='bulk load in batched transactions')
+    ap.add_argument('-B', '--batch-size', default=None, type=int,
+                    help='rows per transaction in bulk load')
+    ap.add_argument('-P', '--page-size', default=None, type=int,
+                    help='SQLite page size for new bulk-loaded databases')
+    ap.add_argument('-c', '--compress', default=False, action='store_true',
+                    help='compress values with a trained dictionary '
+                    '(implies -b)')
+    ap.add_argument('-C', '--codec', default=default_codec(),
+                    choices=sorted(codecs),
+                    help='compression codec (default {})'.format(
+                        default_codec()))
+    ap.add_argument('-f', '--fts', default=False, action='store_true',
+                    help='build full-text index over titles and abstracts')
+    ap.add_argument('-T', '--fts-tokenizer', default='unicode61',
+                    help='FTS5 tokenizer, one of {} or an FTS5 tokenize '
+                    'argument (default unicode61)'.format(
+                        ', '.join(sorted(FTS_TOKENIZERS))))
+    ap.add_argument('-j', '--jobs', default=8, type=int,
+                    help='threads for reading files from directories')
     ap.add_argument('db', help='database name')
     ap.add_argument('path', nargs='+', help='file or dir to insert into DB')
     return ap
@@ -36,13 +70,19 @@ def get_key(name, options):
         return os.path.basename(name)
     
 
+def has_suffix(name, options):
+    return options.suffix is None or name.endswith(options.suffix)
+
+
 def process_tgz(db, path, options):
     insert_count = 0
     print('Processing {}'.format(path), file=sys.stderr)
-    with tarfile.open(path, 'r:gz') as tar:
-        for m in tar.getmembers():
-            suffix = os.path.splitext(m.name)
-            if options.suffix is not None and options.suffix != suffix:
+    # Stream mode ('r|gz') reads members one at a time instead of
+    # loading all headers up front as getmembers() does.
+    with tarfile.open(path, 'r|gz') as tar:
+        for m in tar:
+            tar.members = []    # TarFile keeps all TarInfos otherwise
+            if not m.isfile() or not has_suffix(m.name, options):
                 continue
             f = tar.extractfile(m)
             if f is None:
@@ -74,22 +114,81 @@ def process_file(db, path, options):
     return 1
         
 
-def process(dbname, path, options):
-    with sqlitedict.SqliteDict(dbname, autocommit=True) as db:
-        if is_tar_gzip(path):
-            return process_tgz(db, path, options)
-        elif os.path.isfile(path):
-            return process_file(db, path, options)
-        elif os.path.isdir(path):
-            raise NotImplementedError()
-    
+def open_db(dbname, options):
+    if options.bulk or options.compress:
+        return BulkLoader(dbname, batch_size=options.batch_size,
+                          page_size=options.page_size,
+                          codec=options.codec if options.compress else None)
+    else:
+        return open_sqlitedict(dbname)
+
+
+def iter_files(path, options):
+    """Yield paths of files with suffix in directory tree at path."""
+    with os.scandir(path) as it:
+        for entry in it:
+            if entry.is_dir(follow_symlinks=False):
+                yield from iter_files(entry.path, options)
+            elif entry.is_file() and has_suffix(entry.name, options):
+                yield entry.path
+
+
+def read_file(path):
+    with open(path, encoding='utf-8') as f:
+        return path, f.read()
+
+
+def read_files(paths, jobs):
+    """Yield (path, content) in order, reading files on a thread pool."""
+    # Bounded number of reads in flight; Executor.map() would submit
+    # all paths up front.
+    pending = deque()
+    with ThreadPoolExecutor(max_workers=jobs) as executor:
+        for path in paths:
+            pending.append(executor.submit(read_file, path))
+            if len(pending) >= 4 * jobs:
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
+
+
+def process_dir(db, path, options):
+    insert_count = 0
+    print('Processing {}'.format(path), file=sys.stderr)
+    for fn, content in read_files(iter_files(path, options), options.jobs):
+        key = get_key(fn, options)
+        db[key] = content
+        insert_count += 1
+        if insert_count % 1000 == 0:
+            print('Inserted {} ...'.format(insert_count), end='\r',
+                  file=sys.stderr, flush=True)
+    print('Done, inserted {}, committing...'.format(insert_count),
+          end='', file=sys.stderr, flush=True)
+    db.commit()
+    print('done.', file=sys.stderr)
+    return insert_count
+
+
+def process(db, path, options):
+    if is_tar_gzip(path):
+        return process_tgz(db, path, options)
+    elif os.path.isfile(path):
+        return process_file(db, path, options)
+    elif os.path.isdir(path):
+        return process_dir(db, path, options)
 
 
 def main(argv):
     args = argparser().parse_args(argv[1:])
     total = 0
-    for path in args.path:
-        total += process(args.db, path, args)
+    with open_db(args.db, args) as db:
+        for path in args.path:
+            total += process(db, path, args)
+    if args.fts:
+        print('Building full-text index...', end='', file=sys.stderr,
+              flush=True)
+        build_fts(args.db, args.fts_tokenizer)
+        print('done.', file=sys.stderr)
     print('Finished, inserted {}.'.format(total), file=sys.stderr)
     return 0
 
@@ -0,0 +1,71 @@
+#!/usr/bin/env python3
+
+# Search the full-text index built by makedb.py --fts and output
+# matching PMIDs ranked by BM25.
+
+import os
+import sys
+import sqlite3
+
+from logging import error
+
+# citationdb.py and gtbtokenize.py are found in the parent directory
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                os.pardir))
+
+from citationdb import fts_table, read_meta, search, table_exists
+
+
+def argparser():
+    from argparse import ArgumentParser
+    ap = ArgumentParser()
+    ap.add_argument('-n', '--number', default=10, type=int,
+                    help='maximum number of results (default 10)')
+    ap.add_argument('-w', '--title-weight', default=1.0, type=float,
+                    help='BM25 weight of title relative to abstract')
+    ap.add_argument('-r', '--raw', default=False, action='store_true',
+                    help='pass query to SQLite as FTS5 query syntax')
+    ap.add_argument('-s', '--scores', default=False, action='store_true',
+                    help='output BM25 scores')
+    ap.add_argument('db', help='database name')
+    ap.add_argument('query', nargs='+', help='query terms')
+    return ap
+
+
+def quote(term):
+    return '"{}"'.format(term.replace('"', '""'))
+
+
+def make_query(terms, tokenizer):
+    """Return FTS5 query matching all terms."""
+    text = ' '.join(terms)
+    if tokenizer == 'gtb':
+        # tokenize as the indexed text
+        from gtbtokenize import tokenize
+        text = tokenize(text)
+    return ' '.join(quote(t) for t in text.split())
+
+
+def main(argv):
+    args = argparser().parse_args(argv[1:])
+    conn = sqlite3.connect('file:{}?mode=ro'.format(args.db), uri=True)
+    if not table_exists(conn, fts_table('unnamed')):
+        error('no full-text index in {}, run makedb.py --fts'.format(args.db))
+        return 1
+    if args.raw:
+        query = ' '.join(args.query)
+    else:
+        tokenizer = read_meta(conn).get('fts_tokenizer')
+        query = make_query(args.query, tokenizer)
+    results = search(conn, query, args.number, (args.title_weight, 1.0))
+    for pmid, score in results:
+        if args.scores:
+            print('{}\t{:.4f}'.format(pmid, -score))
+        else:
+            print(pmid)
+    conn.close()
+    return 0 if results else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv))